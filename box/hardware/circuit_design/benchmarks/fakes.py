@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+'''
+Fake hardware backends for running the switch and LED drivers without a
+Raspberry Pi.
+
+- FakeSMBus models the PCA9555D chips on the I2C bus, including their
+  interrupt output
+- FakeSPITransport stands in for the SPI bus of the MAX6969 chain
+- `use_mock_pins()` switches gpiozero to its mock pin factory
+
+Both fakes can add a delay to every transaction and fail a share of them, so
+the drivers' retry and error paths can be measured as well as their fast path.
+'''
+from typing import Optional
+import os
+import random
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CIRCUIT_DESIGN = os.path.dirname(HERE)
+
+
+def use_mock_pins() -> None:
+    '''
+    `use_mock_pins()` makes gpiozero create mock pins that support PWM, so the
+    drivers can claim their GPIO pins on any machine.
+    '''
+    from gpiozero import Device
+    from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+    if Device.pin_factory is not None:
+        Device.pin_factory.close()
+    Device.pin_factory = MockFactory(pin_class=MockPWMPin)
+
+
+def import_drivers() -> tuple[types.ModuleType, types.ModuleType]:
+    '''
+    `import_drivers()` is the (switch_board_lib, led_board_lib) modules.
+
+    The switch driver imports `smbus`, which is usually only installed on a Pi.
+    If it is missing a stand-in module is registered whose SMBus is a FakeSMBus,
+    only the type annotations and demos of the driver use it.
+    '''
+    try:
+        import smbus  # noqa: F401
+    except ImportError:
+        sys.modules['smbus'] = types.SimpleNamespace(SMBus=FakeSMBus)
+
+    for board in ('switch_board', 'led_board'):
+        path = os.path.join(CIRCUIT_DESIGN, board)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    import switch_board_lib
+    import led_board_lib
+    return switch_board_lib, led_board_lib
+
+
+class FakeSMBus:
+    '''
+    SMBus stand-in that models PCA9555D chips.
+
+    Each chip has the input, output, polarity inversion and configuration
+    register pairs, and resets to the power-on defaults. The input registers read
+    the pin levels set with `set_pins()` through the polarity inversion. When a
+    chip's pins change, the shared interrupt line is pulled low until one of that
+    chip's input registers is read, as on the real chip.
+
+    Every transaction can be delayed by `latency_secs`, and fails with an OSError
+    with probability `error_rate`.
+    '''
+
+    INPUT_PORT_0 = 0
+    POLARITY_PORT_0 = 4
+
+    POWER_ON_DEFAULTS = {2: 0xFFFF, 4: 0x0000, 6: 0xFFFF}
+
+    def __init__(
+        self,
+        addrs: list[int],
+        latency_secs: float = 0.0,
+        error_rate: float = 0.0,
+        interrupt_pin=None,
+        seed: Optional[int] = None
+    ) -> None:
+        '''
+        `FakeSMBus(addrs)` is a bus with a PCA9555D at each address in `addrs`, with
+        every pin pulled high.
+
+        Args:
+            `addrs` (list[int]): the chip addresses
+            `latency_secs` (float): how long every transaction takes
+            `error_rate` (float): the chance that a transaction fails, in [0.0, 1.0]
+            `interrupt_pin`: a gpiozero MockPin wired to the chips' interrupt outputs
+            `seed` (int): seed for the error injection, for repeatable runs
+        '''
+        self.latency_secs = latency_secs
+        self.error_rate = error_rate
+        self._interrupt_pin = interrupt_pin
+        self._random = random.Random(seed)
+
+        self._pins = {addr: 0xFFFF for addr in addrs}
+        self._registers = {addr: dict(self.POWER_ON_DEFAULTS) for addr in addrs}
+        self._pointer = {addr: self.INPUT_PORT_0 for addr in addrs}
+        self._interrupting = set()
+
+        self.num_transactions = 0
+        self.num_errors = 0
+
+    def set_pins(self, addr: int, word: int) -> None:
+        '''
+        `set_pins(addr, w)` sets the pin levels of the chip at `addr` to the 16 bit
+        word `w`, and pulls the interrupt line low if they changed.
+        '''
+        if self._pins[addr] == word:
+            return
+        self._pins[addr] = word
+        self._interrupting.add(addr)
+        if self._interrupt_pin is not None:
+            self._interrupt_pin.drive_low()
+
+    def brownout(self, addr: int) -> None:
+        '''
+        `brownout(addr)` resets the registers of the chip at `addr` to their
+        power-on defaults.
+        '''
+        self._registers[addr] = dict(self.POWER_ON_DEFAULTS)
+
+    def _transaction(self, addr: int) -> None:
+        self.num_transactions += 1
+        if self.latency_secs > 0.0:
+            time.sleep(self.latency_secs)
+        if addr not in self._pins or self._random.random() < self.error_rate:
+            self.num_errors += 1
+            raise OSError(121, 'Remote I/O error')
+
+    def _read_register(self, addr: int, reg: int) -> int:
+        '''
+        `_read_register(addr, reg)` is the byte in register `reg` of the chip at `addr`.
+        '''
+        pair = reg & ~1
+        if pair == self.INPUT_PORT_0:
+            word = self._pins[addr] ^ self._registers[addr][self.POLARITY_PORT_0]
+            self._release_interrupt(addr)
+        else:
+            word = self._registers[addr][pair]
+        return (word >> (8 * (reg & 1))) & 0xFF
+
+    def _write_register(self, addr: int, reg: int, value: int) -> None:
+        pair = reg & ~1
+        if pair == self.INPUT_PORT_0:
+            return
+        shift = 8 * (reg & 1)
+        word = self._registers[addr][pair]
+        self._registers[addr][pair] = (word & ~(0xFF << shift)) | (value << shift)
+
+    def _release_interrupt(self, addr: int) -> None:
+        self._interrupting.discard(addr)
+        if not self._interrupting and self._interrupt_pin is not None:
+            self._interrupt_pin.drive_high()
+
+    def _read_block(self, addr: int, reg: int, length: int) -> list[int]:
+        # the register pointer toggles within a register pair
+        data = []
+        for _ in range(length):
+            data.append(self._read_register(addr, reg))
+            reg = (reg & ~1) | ((reg + 1) & 1)
+        self._pointer[addr] = reg
+        return data
+
+    def read_byte(self, addr: int) -> int:
+        self._transaction(addr)
+        return self._read_block(addr, self._pointer[addr], 1)[0]
+
+    def read_byte_data(self, addr: int, reg: int) -> int:
+        self._transaction(addr)
+        return self._read_block(addr, reg, 1)[0]
+
+    def read_i2c_block_data(self, addr: int, reg: int, length: int) -> list[int]:
+        self._transaction(addr)
+        return self._read_block(addr, reg, length)
+
+    def write_byte_data(self, addr: int, reg: int, value: int) -> None:
+        self._transaction(addr)
+        self._write_register(addr, reg, value)
+
+    def write_i2c_block_data(self, addr: int, reg: int, data: list[int]) -> None:
+        self._transaction(addr)
+        for value in data:
+            self._write_register(addr, reg, value)
+            reg = (reg & ~1) | ((reg + 1) & 1)
+
+    def i2c_rdwr(self, *msgs) -> None:
+        '''
+        `i2c_rdwr(*msgs)` runs smbus2 i2c_msg messages as one combined transfer,
+        which fails as a whole.
+        '''
+        self.num_transactions += 1
+        if self.latency_secs > 0.0:
+            time.sleep(self.latency_secs)
+        if any(msg.addr not in self._pins for msg in msgs) or self._random.random() < self.error_rate:
+            self.num_errors += 1
+            raise OSError(121, 'Remote I/O error')
+
+        for msg in msgs:
+            if msg.flags & 1:
+                for i, value in enumerate(self._read_block(msg.addr, self._pointer[msg.addr], msg.len)):
+                    msg.buf[i] = value
+            else:
+                data = list(msg)
+                self._pointer[msg.addr] = data[0]
+                reg = data[0]
+                for value in data[1:]:
+                    self._write_register(msg.addr, reg, value)
+                    reg = (reg & ~1) | ((reg + 1) & 1)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeSPITransport:
+    '''
+    UI_LEDs transport that counts frames instead of sending them, with an
+    optional delay per frame and injected failures.
+    '''
+
+    def __init__(self, latency_secs: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None) -> None:
+        '''
+        `FakeSPITransport(secs, rate)` takes `secs` to send each frame and fails
+        with probability `rate`.
+        '''
+        self.latency_secs = latency_secs
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+        self.last_frame = b''
+        self.num_sends = 0
+        self.num_errors = 0
+
+    def send(self, data: bytes) -> None:
+        self.num_sends += 1
+        if self.latency_secs > 0.0:
+            time.sleep(self.latency_secs)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.num_errors += 1
+            raise OSError(5, 'Input/output error')
+        self.last_frame = bytes(data)
+
+    def close(self) -> None:
+        pass
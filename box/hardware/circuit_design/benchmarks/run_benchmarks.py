@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks for the switch and LED drivers that run on any Linux machine, using
+the fake backends in fakes.py.
+
+Usage:
+    python run_benchmarks.py [--out results.json] [--baseline old.json]
+
+Every result is printed and saved as JSON. Given a baseline file, any result
+that got worse by more than the tolerance is listed and the exit status is 1,
+so a regression can fail a build.
+'''
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+
+import fakes
+
+# the standard panel, see the switch board demo
+ADDRS = (0x20, 0x22, 0x21, 0x23)
+BOARDS = [(0x20, 0x21), (0x22, 0x23)]
+INTERRUPT_PIN = 19
+PWM_PIN = 12
+
+# results where a higher value is better, every other result is a cost
+HIGHER_IS_BETTER = ('per_sec', 'frames_sec')
+
+
+def percentiles(samples_ns: list[int]) -> dict:
+    '''
+    `percentiles(samples)` is the p50, p90, p99 and max of the nanosecond
+    `samples`, in microseconds, each one None if there are no samples.
+    '''
+    samples = sorted(samples_ns)
+    if not samples:
+        return {'p50_us': None, 'p90_us': None, 'p99_us': None, 'max_us': None}
+
+    def at(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] / 1e3
+
+    return {'p50_us': at(0.50), 'p90_us': at(0.90), 'p99_us': at(0.99), 'max_us': samples[-1] / 1e3}
+
+
+def make_switches(switch_board_lib, bus, watchdog: bool = False, **kwargs):
+    # the watchdog would poll behind the benchmark's back, unless the benchmark
+    # measures the recovery it makes
+    if not watchdog:
+        kwargs['watchdog_check_secs'] = 0.0
+    return switch_board_lib.UI_Switches.from_boards(bus, BOARDS, INTERRUPT_PIN, **kwargs)
+
+
+def bench_poll_throughput(switch_board_lib, args) -> dict:
+    '''
+    `bench_poll_throughput()` is the polls per second for each read mode, with the
+    configured bus latency and error rate.
+    '''
+    UI_Switches = switch_board_lib.UI_Switches
+
+    read_modes = [UI_Switches.ReadMode.BYTE, UI_Switches.ReadMode.BLOCK]
+    if switch_board_lib.i2c_msg is not None:
+        read_modes.append(UI_Switches.ReadMode.BATCH)
+
+    results = {}
+    for read_mode in read_modes:
+        bus = fakes.FakeSMBus(ADDRS, args.latency_us / 1e6, args.error_rate, seed=args.seed)
+        ui_switches = make_switches(switch_board_lib, bus, read_mode=read_mode)
+
+        num_polls = 0
+        transactions = ui_switches.get_num_i2c_transactions()
+        start = time.perf_counter()
+        stop = start + args.duration
+        while time.perf_counter() < stop:
+            ui_switches.poll()
+            num_polls += 1
+        elapsed = time.perf_counter() - start
+
+        results[read_mode.name] = {
+            'polls_per_sec': num_polls / elapsed,
+            'transactions_per_poll': (ui_switches.get_num_i2c_transactions() - transactions) / num_polls,
+            'bus_errors': bus.num_errors,
+        }
+        ui_switches.close()
+    return results
+
+
+def bench_decode(switch_board_lib, args) -> dict:
+    '''
+    `bench_decode()` is the cost of the decoding accessors, both on a fresh
+    snapshot and on one that has already been decoded.
+    '''
+    bus = fakes.FakeSMBus(ADDRS)
+    ui_switches = make_switches(switch_board_lib, bus)
+    rng = random.Random(args.seed)
+
+    patterns = [[rng.getrandbits(16) for _ in ADDRS] for _ in range(64)]
+
+    def time_calls(func, num_calls):
+        start = time.perf_counter_ns()
+        for _ in range(num_calls):
+            func()
+        return (time.perf_counter_ns() - start) / num_calls
+
+    # the first call after a change builds the positions, so change before every call
+    fresh_ns = []
+    for n in range(2000):
+        for addr, word in zip(ADDRS, patterns[n % len(patterns)]):
+            bus.set_pins(addr, word)
+        ui_switches.poll()
+        fresh_ns.append(time_calls(ui_switches.list_of_v_switch_positions, 1))
+
+    results = {
+        'list_of_v_switch_positions_fresh_ns': statistics.median(fresh_ns),
+        'list_of_v_switch_positions_ns': time_calls(ui_switches.list_of_v_switch_positions, 20000),
+        'get_shock_level_ns': time_calls(ui_switches.get_shock_level, 100000),
+        'v_switch_position_at_ns': time_calls(lambda: ui_switches.v_switch_position_at(17), 100000),
+    }
+    ui_switches.close()
+    return results
+
+
+def bench_interrupt_latency(switch_board_lib, args) -> dict:
+    '''
+    `bench_interrupt_latency()` is the percentiles of the time from a switch
+    changing, which pulls the interrupt line low, to the event callback, with
+    callbacks on the interrupt thread and on the dispatcher thread.
+
+    The watchdog runs with its default settings. A read that fails leaves the line
+    low, so no later change makes an edge until the watchdog recovers it. With
+    `--error-rate` above 0 the percentiles therefore include that recovery.
+    '''
+    from gpiozero import Device
+
+    results = {}
+    for threaded in (False, True):
+        interrupt_pin = Device.pin_factory.pin(INTERRUPT_PIN)
+        bus = fakes.FakeSMBus(
+            ADDRS, args.latency_us / 1e6, args.error_rate, interrupt_pin=interrupt_pin, seed=args.seed)
+
+        done = threading.Event()
+        callback_t_ns = []
+        wanted_seq = [0]
+
+        # the dispatcher may still be delivering an older snapshot, wait for the new one
+        def snapshot_callback(snapshot):
+            if snapshot.seq >= wanted_seq[0] and not done.is_set():
+                callback_t_ns.append(time.perf_counter_ns())
+                done.set()
+
+        ui_switches = make_switches(
+            switch_board_lib, bus, watchdog=True, threaded_callbacks=threaded, snapshot_callback=snapshot_callback)
+
+        latencies_ns = []
+        for n in range(args.samples):
+            wanted_seq[0] = ui_switches.get_snapshot().seq + 1
+            callback_t_ns.clear()
+            done.clear()
+            start_ns = time.perf_counter_ns()
+            addr = ADDRS[n % len(ADDRS)]
+            # every sample closes a new set of switches on one chip, so the pins always change
+            bus.set_pins(addr, ((n + 1) & 0xFFFF) ^ 0xFFFF)
+            if done.wait(1.0):
+                latencies_ns.append(callback_t_ns[0] - start_ns)
+
+        watchdog_stats = ui_switches.get_watchdog_stats()
+        results['threaded' if threaded else 'direct'] = dict(
+            percentiles(latencies_ns), samples=len(latencies_ns), missed=args.samples - len(latencies_ns),
+            stuck_episodes=watchdog_stats['stuck_episodes'], watchdog_polls=watchdog_stats['watchdog_polls'])
+        ui_switches.close()
+    return results
+
+
+def bench_leds(led_board_lib, args) -> dict:
+    '''
+    `bench_leds()` is the LED frames per second against the length of the chain,
+    for whole-word and single-LED writes, with the configured SPI latency.
+    '''
+    results = {}
+    for num_chips in (2, 4, 8):
+        transport = fakes.FakeSPITransport(args.spi_latency_us / 1e6)
+        ui_leds = led_board_lib.UI_LEDs(None, None, PWM_PIN, transport=transport, num_chips=num_chips)
+        results[f'{num_chips}_chips'] = {
+            'write_multi_frames_sec': led_board_lib.measure_frame_rate(ui_leds, args.duration),
+            'write_single_frames_sec': led_board_lib.measure_single_rate(ui_leds, args.duration),
+        }
+        ui_leds.close()
+    return results
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    '''
+    `flatten(results)` is the numeric results keyed by their slash separated path.
+    '''
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}/{key}' if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    '''
+    `find_regressions(new, old, tol)` is a description of every benchmark result in
+    `new` that is more than the fraction `tol` worse than in `old`.
+    '''
+    new = flatten(results['benchmarks'])
+    old = flatten(baseline['benchmarks'])
+
+    regressions = []
+    for path, value in new.items():
+        if path not in old or not old[path] or path.endswith(
+                ('errors', 'missed', 'samples', '_per_poll', 'stuck_episodes', 'watchdog_polls')):
+            continue
+        change = (value - old[path]) / old[path]
+        if any(path.endswith(suffix) for suffix in HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            regressions.append(f'{path}: {old[path]:.4g} -> {value:.4g} ({change:.0%} worse)')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='benchmark_results.json', help='where to save the results')
+    parser.add_argument('--baseline', help='earlier results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much worse a result may get before it is a regression')
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds per throughput run')
+    parser.add_argument('--samples', type=int, default=2000, help='interrupt latency samples')
+    parser.add_argument('--latency-us', type=float, default=0.0, help='I2C transaction latency')
+    parser.add_argument('--spi-latency-us', type=float, default=0.0, help='SPI frame latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of I2C transactions that fail')
+    parser.add_argument('--seed', type=int, default=1, help='seed for patterns and error injection')
+    args = parser.parse_args()
+
+    fakes.use_mock_pins()
+    switch_board_lib, led_board_lib = fakes.import_drivers()
+
+    results = {
+        'config': vars(args),
+        'platform': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'system': platform.platform(),
+        },
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'benchmarks': {},
+    }
+
+    benchmarks = [
+        ('poll_throughput', lambda: bench_poll_throughput(switch_board_lib, args)),
+        ('decode', lambda: bench_decode(switch_board_lib, args)),
+        ('interrupt_to_callback', lambda: bench_interrupt_latency(switch_board_lib, args)),
+        ('leds', lambda: bench_leds(led_board_lib, args)),
+    ]
+    for name, bench in benchmarks:
+        results['benchmarks'][name] = bench()
+        print(name)
+        for path, value in flatten(results['benchmarks'][name]).items():
+            print(f'    {path:45s} {value:14.2f}')
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results saved to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print('no regressions')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
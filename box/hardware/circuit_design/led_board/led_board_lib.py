@@ -7,9 +7,214 @@ Prereqs:
 - enable SPI in /boot/config.txt, uncomment dtparam=spi=on
 
 '''
+from typing import Callable, Iterator, Optional
+from concurrent.futures import Future, InvalidStateError
+from contextlib import contextmanager
+from enum import Enum
+import asyncio
+import os
+import struct
+import threading
 import time
 import gpiozero
 
+# the fast SPI transport needs spidev, and libgpiod v2 for a GPIO chip select
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+try:
+    import gpiod
+    from gpiod.line import Direction, Value
+except ImportError:
+    gpiod = None
+
+
+class GpiozeroSPITransport:
+    '''
+    SPI transport through a gpiozero SPIDevice, with a gpiozero output pin as
+    the chip select. Works wherever gpiozero does, but every frame pays for
+    gpiozero's pin and SPI layers, and the transfer uses the SPIDevice's
+    private `_spi` interface.
+    '''
+
+    def __init__(self, spi: gpiozero.SPIDevice, cs_pin: int) -> None:
+        '''
+        `GpiozeroSPITransport(spi, cs)` sends frames on `spi` while driving pin
+        `cs` low.
+        '''
+        self.spi = spi
+        self.chip_sel = gpiozero.DigitalOutputDevice(cs_pin, active_high=False)
+
+    def send(self, data: bytes) -> None:
+        '''
+        `send(d)` transfers the bytes `d` with chip select held active.
+        '''
+        self.chip_sel.on()
+        self.spi._spi.transfer(data)
+        self.chip_sel.off()
+
+    def close(self) -> None:
+        '''
+        `close()` releases the chip select pin.
+        '''
+        self.chip_sel.close()
+
+
+class SpidevTransport:
+    '''
+    SPI transport straight to the kernel spidev driver.
+
+    With no chip select pin the controller's hardware chip select is used,
+    which the kernel toggles inside the transfer. Otherwise the chip select is
+    a GPIO line driven through the GPIO character device with libgpiod, which
+    is one ioctl per edge.
+    '''
+
+    def __init__(
+        self,
+        bus: int = 0,
+        device: int = 0,
+        max_speed_hz: int = 1_000_000,
+        cs_pin: Optional[int] = None,
+        gpio_chip: str = '/dev/gpiochip0'
+    ) -> None:
+        '''
+        `SpidevTransport(bus, dev)` opens /dev/spidev`bus`.`dev`.
+
+        Args:
+            `bus` (int): the SPI controller number
+            `device` (int): the hardware chip select number of the controller
+            `max_speed_hz` (int): the SPI clock rate
+            `cs_pin` (int): a GPIO line to use as chip select, None for the hardware one
+            `gpio_chip` (str): the GPIO character device that has `cs_pin`
+
+        Raises:
+            RuntimeError if spidev, or libgpiod v2 for a GPIO chip select, is not installed.
+            OSError if the devices can not be opened.
+        '''
+        if spidev is None:
+            raise RuntimeError('SpidevTransport requires the spidev python bindings')
+        if cs_pin is not None and gpiod is None:
+            raise RuntimeError('a GPIO chip select requires the libgpiod v2 python bindings')
+
+        self._spi = spidev.SpiDev()
+        self._spi.open(bus, device)
+        self._spi.max_speed_hz = max_speed_hz
+        self._spi.mode = 0
+
+        self._cs_pin = cs_pin
+        self._cs_request = None
+        if cs_pin is not None:
+            # the hardware chip select must stay idle while a GPIO one is used
+            self._spi.no_cs = True
+            self._cs_request = gpiod.request_lines(
+                gpio_chip,
+                consumer='UI_LEDs',
+                config={
+                    cs_pin: gpiod.LineSettings(
+                        direction=Direction.OUTPUT, active_low=True, output_value=Value.INACTIVE)
+                }
+            )
+
+    def send(self, data: bytes) -> None:
+        '''
+        `send(d)` transfers the bytes `d` with chip select held active. `d` may be
+        any buffer, it is written without being copied into a list.
+        '''
+        if self._cs_request is None:
+            self._spi.writebytes2(data)
+            return
+
+        self._cs_request.set_value(self._cs_pin, Value.ACTIVE)
+        self._spi.writebytes2(data)
+        self._cs_request.set_value(self._cs_pin, Value.INACTIVE)
+
+    def close(self) -> None:
+        '''
+        `close()` releases the SPI device and the chip select line.
+        '''
+        self._spi.close()
+        if self._cs_request is not None:
+            self._cs_request.release()
+
+
+class MockSPITransport:
+    '''
+    SPI transport that keeps every frame instead of sending it, for testing
+    without the hardware.
+    '''
+
+    def __init__(self, keep_frames: bool = True) -> None:
+        '''
+        `MockSPITransport()` is a transport with no frames sent.
+        `MockSPITransport(False)` only counts the frames, for benchmarks.
+        '''
+        self.frames = []
+        self.num_sends = 0
+        self._keep_frames = keep_frames
+
+    def send(self, data: bytes) -> None:
+        '''
+        `send(d)` keeps a copy of the bytes `d` in `frames`.
+        '''
+        self.num_sends += 1
+        if self._keep_frames:
+            self.frames.append(bytes(data))
+
+    def close(self) -> None:
+        '''
+        `close()` does nothing, the captured frames are kept.
+        '''
+
+
+def _make_word_packer(num_bytes: int) -> Callable[[bytearray, int], None]:
+    '''
+    `_make_word_packer(n)` is a function `pack(frame, word)` that writes `word` into
+    the first `n` bytes of `frame`, big endian, without making a bytes object.
+
+    The word is split into 64 bit fields, after a shorter leading field for chains
+    that are not a multiple of four chips, and packed with one precompiled struct.
+    The leading field is not masked, so a word that is too long still fails to
+    pack. The split is written out for chains of up to 16 chips, which keeps the
+    cost level with `int.to_bytes()`; a comprehension would cost three times that.
+    '''
+    field_sizes = {0: [], 2: [2], 4: [4], 6: [2, 4]}[num_bytes % 8] + [8] * (num_bytes // 8)
+    pack_into = struct.Struct('>' + ''.join({2: 'H', 4: 'I', 8: 'Q'}[size] for size in field_sizes)).pack_into
+
+    # (shift, mask) of each field, most significant first
+    fields = []
+    shift = num_bytes * 8
+    for size in field_sizes:
+        shift -= size * 8
+        fields.append((shift, (1 << size * 8) - 1 if fields else -1))
+
+    if len(fields) == 1:
+        def pack(frame: bytearray, word: int) -> None:
+            pack_into(frame, 0, word)
+    elif len(fields) == 2:
+        (shift_0, _), (_, mask_1) = fields
+
+        def pack(frame: bytearray, word: int) -> None:
+            pack_into(frame, 0, word >> shift_0, word & mask_1)
+    elif len(fields) == 3:
+        (shift_0, _), (shift_1, mask_1), (_, mask_2) = fields
+
+        def pack(frame: bytearray, word: int) -> None:
+            pack_into(frame, 0, word >> shift_0, (word >> shift_1) & mask_1, word & mask_2)
+    elif len(fields) == 4:
+        (shift_0, _), (shift_1, mask_1), (shift_2, mask_2), (_, mask_3) = fields
+
+        def pack(frame: bytearray, word: int) -> None:
+            pack_into(
+                frame, 0, word >> shift_0, (word >> shift_1) & mask_1, (word >> shift_2) & mask_2, word & mask_3)
+    else:
+        def pack(frame: bytearray, word: int) -> None:
+            pack_into(frame, 0, *[(word >> shift) & mask for shift, mask in fields])
+
+    return pack
+
 
 class UI_LEDs:
     '''
@@ -20,6 +225,10 @@ class UI_LEDs:
     MAX6969[0] handles LEDs 0..15
     MAX6969[1] handles LEDs 16..31
 
+    More lamp boards can be driven by daisy-chaining more MAX6969 chips, chip
+    `k` handles LEDs 16k..16k+15. The frame is kept in a preallocated bytearray
+    that is edited in place and handed straight to the SPI transfer.
+
     Requires:
         - Shared use of SPI bus.
 
@@ -30,21 +239,84 @@ class UI_LEDs:
         CS pins could be used.
 
         - One PWM enabled pin for the brightness control.
+
+        The SPI bus and chip select are reached through a transport. By default
+        this is a GpiozeroSPITransport, a SpidevTransport is much cheaper per
+        frame and a MockSPITransport captures the frames for testing.
+
+    Several LEDs can be changed with a single SPI transfer by editing a frame:
+    after `begin()` every write only edits a back buffer, and `commit()` sends
+    the finished frame, or nothing if it matches what the chips already show.
+    A frame belongs to the thread that began it, writes from other threads wait
+    until it has been committed. Use `with leds.frame():` rather than calling
+    `begin()` and `commit()` directly, so an exception can't leave the frame open.
+
+    The writes are safe to call from several threads. Coroutines should go
+    through an AsyncLEDWriter, which never blocks the event loop on SPI.
+
+    `fade_to()` ramps the brightness on a background thread and returns at once.
+    Fades run in perceived brightness, which a gamma table turns into PWM duty,
+    so they look even to the eye.
     '''
 
-    # the number of LEDs
+    # the number of LEDs on the standard two chip chain, instances with more chips override it
     NUM_LEDS = 32
 
-    def __init__(self, spi: gpiozero.SPIDevice, cs_pin: int, pwm_pin: int) -> None:
+    LEDS_PER_CHIP = 16  # each MAX6969 has 16 outputs
+
+    # perceived brightness b needs a PWM duty of b ** GAMMA
+    GAMMA = 2.2
+
+    # the PWM duty is quantized to this many steps above zero
+    DUTY_STEPS = 1023
+
+    # how often a fade recomputes the brightness
+    FADE_STEP_SECS = 0.01
+
+    class Easing(Enum):
+        '''
+        Enumerated shapes of a fade's progress over time.
+
+        LINEAR      : constant speed
+        EASE_IN     : starts slowly and speeds up
+        EASE_OUT    : starts quickly and slows down
+        EASE_IN_OUT : slow at both ends
+        '''
+        LINEAR = 0
+        EASE_IN = 1
+        EASE_OUT = 2
+        EASE_IN_OUT = 3
+
+    # the fraction of the change made at each fraction of the fade time
+    EASING_CURVES = {
+        Easing.LINEAR: lambda t: t,
+        Easing.EASE_IN: lambda t: t * t,
+        Easing.EASE_OUT: lambda t: t * (2.0 - t),
+        Easing.EASE_IN_OUT: lambda t: t * t * (3.0 - 2.0 * t),
+    }
+
+    def __init__(
+        self,
+        spi: gpiozero.SPIDevice,
+        cs_pin: int,
+        pwm_pin: int,
+        transport=None,
+        num_chips: int = 2
+    ) -> None:
         '''
         `UI_LEDs(spi, cs, pwm)` initializes the UI LEDs with the given SPI core
         `spi`, Chip Select pin number `cs`, and PWM pin number `pwm`, and finally
         turns all the LEDs off.
 
+        `UI_LEDs(None, None, pwm, transport=t)` sends frames with the transport `t`.
+
         Args:
             `spi` (gpiozero.SPIDevice): the SPI device to use
             `cs_pin` (int): the GPIO pin number to use for Chip Select
             `pwm_pin`(int): the GPIO pin number to use for the PWM brightness control
+            `transport`: any object with `send(data)` and `close()`, it replaces
+                `spi` and `cs_pin`
+            `num_chips` (int): the number of MAX6969 chips in the chain
 
         Note:
             prefer pins 12, 13, 18, or 19 for the PWM pin, these are hardware
@@ -55,17 +327,63 @@ class UI_LEDs:
 
         Raises:
             PinInvalidPin if either the `cs` or `pwm` pins are not valid pin numbers.
+            ValueError if `num_chips` is less than 1.
         '''
-        self.spi = spi
+        if num_chips < 1:
+            raise ValueError('there must be at least one MAX6969 chip')
 
-        self.chip_sel = gpiozero.DigitalOutputDevice(cs_pin, active_high=False)
+        if transport is None:
+            transport = GpiozeroSPITransport(spi, cs_pin)
+        self.transport = transport
+
+        self.NUM_LEDS = self.LEDS_PER_CHIP * num_chips
+        self._all_leds = (1 << self.NUM_LEDS) - 1
+
+        # the frame being built and the frame the chips show, both in transfer order:
+        # the first byte holds the highest LEDs, which are shifted to the far end of
+        # the chain. Writes edit `_frame` in place and it is handed to the transport
+        # as is, so no bytes object is made per frame.
+        num_bytes = self.NUM_LEDS // 8
+        self._frame = bytearray(num_bytes)
+        self._shown = bytearray(num_bytes)
+        self._frame_view = memoryview(self._frame)
+        self._pack_word = _make_word_packer(num_bytes)
 
         self.pwm = gpiozero.PWMOutputDevice(
             pwm_pin, active_high=False, initial_value=0.0)
 
-        self.all_off()
+        # duty step for every perceived brightness step
+        self._gamma_lut = [
+            round((step / self.DUTY_STEPS) ** self.GAMMA * self.DUTY_STEPS)
+            for step in range(self.DUTY_STEPS + 1)
+        ]
+
+        # the perceived brightness and the duty step the PWM pin is set to
+        self._level = 0.0
+        self._duty_step = 0
+        self._num_pwm_updates = 0
+
+        # the running fade as (start time, duration, from level, to level, easing curve)
+        self._fade = None
+        self._fade_cv = threading.Condition()
+        self._fade_thread = None
+        self._fade_stop = False
+
+        # false until the first transfer, the chips' contents are unknown before it
+        self._shown_valid = False
+
+        # the thread between `begin()` and `commit()`, whose writes only edit the frame
+        self._frame_owner = None
 
-        self._cached_write = 0
+        # the number of SPI transfers made since initialization
+        self._num_transfers = 0
+
+        # held across each read-modify-write of the pattern and across a whole
+        # frame, writes may nest
+        self._lock = threading.RLock()
+
+        # the chips hold whatever they had before, so this transfer is never skipped
+        self.all_off(force=True)
 
     def set_brightness(self, level: float) -> None:
         '''
@@ -85,18 +403,220 @@ class UI_LEDs:
         if 1.0 < level:
             level = 1.0
 
-        self.pwm.value = level
+        # a brightness that is set directly replaces any fade
+        with self._fade_cv:
+            self._fade = None
+            self._fade_cv.notify_all()
+            self._level = level ** (1.0 / self.GAMMA)
+            self._duty_step = round(level * self.DUTY_STEPS)
+            self.pwm.value = level
+
+    def get_brightness(self) -> float:
+        '''
+        `get_brightness()` is the perceived brightness of the LEDs in [0.0, 1.0],
+        which `fade_to()` ramps.
+        '''
+        return self._level
+
+    def fade_to(self, level: float, duration_secs: float, easing: Easing = Easing.EASE_IN_OUT) -> None:
+        '''
+        `fade_to(b, secs)` fades from the current brightness to the perceived
+        brightness `b` over `secs` seconds, and returns straight away. A fade that
+        is already running is replaced, starting from wherever it had got to.
+
+        Args:
+            `level` (float): the perceived brightness to end at, clamped to [0.0, 1.0]
+            `duration_secs` (float): how long the fade takes, 0.0 jumps straight there
+            `easing` (Easing): the shape of the fade
+
+        Note:
+            perceived brightness `b` is a PWM duty of `b ** GAMMA`, so
+            `fade_to(b, secs)` ends at the same brightness as `set_brightness(b ** GAMMA)`
+        '''
+        level = min(max(level, 0.0), 1.0)
+        curve = self.EASING_CURVES[easing]
+
+        with self._fade_cv:
+            self._fade = (time.monotonic(), duration_secs, self._level, level, curve)
+            if self._fade_thread is None:
+                self._fade_thread = threading.Thread(
+                    target=self._run_fades, name='UI_LEDs fade', daemon=True)
+                self._fade_thread.start()
+            self._fade_cv.notify_all()
+
+    def cancel_fade(self) -> None:
+        '''
+        `cancel_fade()` stops any running fade, the brightness stays where the
+        fade had got to.
+        '''
+        with self._fade_cv:
+            self._fade = None
+            self._fade_cv.notify_all()
+
+    @property
+    def is_fading(self) -> bool:
+        '''
+        `is_fading` is true iff a fade is running.
+        '''
+        return self._fade is not None
+
+    def wait_for_fade(self, timeout: Optional[float] = None) -> bool:
+        '''
+        `wait_for_fade(t)` blocks for at most `t` seconds, or forever if `t` is
+        None, until no fade is running, and is true iff no fade is running.
+        '''
+        with self._fade_cv:
+            return self._fade_cv.wait_for(lambda: self._fade is None, timeout)
+
+    def get_num_pwm_updates(self) -> int:
+        '''
+        `get_num_pwm_updates()` is the number of times a fade has changed the PWM
+        duty. Fade steps that land on the same quantized duty are not written.
+        '''
+        return self._num_pwm_updates
+
+    def _run_fades(self) -> None:
+        with self._fade_cv:
+            while not self._fade_stop:
+                if self._fade is None:
+                    self._fade_cv.wait()
+                    continue
+
+                start_t, duration_secs, from_level, to_level, curve = self._fade
+                progress = 1.0
+                if duration_secs > 0.0:
+                    progress = min(1.0, (time.monotonic() - start_t) / duration_secs)
+                self._show_level(from_level + (to_level - from_level) * curve(progress))
+
+                if progress >= 1.0:
+                    self._fade = None
+                    self._fade_cv.notify_all()
+                    continue
+
+                self._fade_cv.wait(self.FADE_STEP_SECS)
+
+    def _show_level(self, level: float) -> None:
+        '''
+        `_show_level(b)` sets the PWM duty for perceived brightness `b`, the pin is
+        only written if the quantized duty changes.
+        '''
+        self._level = level
+        duty_step = self._gamma_lut[round(level * self.DUTY_STEPS)]
+        if duty_step != self._duty_step:
+            self._duty_step = duty_step
+            self.pwm.value = duty_step / self.DUTY_STEPS
+            self._num_pwm_updates += 1
+
+    def begin(self) -> None:
+        '''
+        `begin()` starts a frame owned by the calling thread. Until that thread
+        calls `commit()` its writes only edit the frame, starting from what the
+        LEDs currently show, and nothing is sent to the chips.
+
+        The lock is held until `commit()`, so writes and frames from other
+        threads wait for the frame instead of landing in it.
+
+        Raises:
+            RuntimeError if this thread has already started a frame.
+        '''
+        self._lock.acquire()
+        if self._frame_owner is not None:
+            # while a frame is open only its owner can take the lock
+            self._lock.release()
+            raise RuntimeError('a frame has already been started')
+        self._frame[:] = self._shown
+        self._frame_owner = threading.get_ident()
+
+    def commit(self) -> None:
+        '''
+        `commit()` ends the frame and shows it with a single SPI transfer. If
+        the frame matches what the LEDs already show nothing is sent.
+
+        Raises:
+            RuntimeError if this thread has not started a frame.
+        '''
+        # only this thread sets the owner to itself, so this is safe without the lock
+        if self._frame_owner != threading.get_ident():
+            raise RuntimeError('no frame has been started by this thread')
+        try:
+            self._frame_owner = None
+            self._send()
+        finally:
+            # taken in `begin()`
+            self._lock.release()
+
+    def abort(self) -> None:
+        '''
+        `abort()` ends the frame without sending it, the writes made in it are
+        thrown away.
+
+        Raises:
+            RuntimeError if this thread has not started a frame.
+        '''
+        if self._frame_owner != threading.get_ident():
+            raise RuntimeError('no frame has been started by this thread')
+        self._frame[:] = self._shown
+        self._frame_owner = None
+        self._lock.release()
+
+    @contextmanager
+    def frame(self) -> Iterator[None]:
+        '''
+        `frame()` is a context manager around `begin()` and `commit()`. If the
+        block raises, the frame is aborted instead of committed.
+
+        Examples:
+            `with leds.frame(): leds.write_single(0, 1); leds.write_single(1, 1)`
+            -> LEDs 0 and 1 light up with a single SPI transfer
+        '''
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self.abort()
+            raise
+        self.commit()
+
+    def get_num_transfers(self) -> int:
+        '''
+        `get_num_transfers()` is the number of SPI transfers made since
+        initialization, each one toggles the chip select line.
+        '''
+        return self._num_transfers
+
+    def get_pattern(self) -> int:
+        '''
+        `get_pattern()` is the word the LEDs are showing, with one bit for every
+        LED, ignoring any frame that has been started but not committed.
+        '''
+        return int.from_bytes(self._shown, 'big')
+
+    def _send(self, force: bool = False) -> None:
+        '''
+        `_send()` transfers the frame to the chips, unless they already show it.
+        Must be called with the lock held and outside of a frame.
+        '''
+        if self._frame == self._shown and self._shown_valid and not force:
+            return
+
+        self.transport.send(self._frame_view)
+        self._shown[:] = self._frame
+        self._shown_valid = True
+        self._num_transfers += 1
 
-    def write_multi(self, word_ui32: int) -> None:
+    def write_multi(self, word_ui32: int, force: bool = False) -> None:
         '''
         `write_multi(w)` sets the UI LEDs to the pattern described by the bits
-        in the 32 bit word `w`.
+        in the 32 bit word `w`, or the NUM_LEDS bit word on a longer chain.
+        Nothing is sent if the LEDs already show `w`, and inside a frame only
+        the frame is changed.
 
         Args:
             `word_ui32` (int): the unsigned 32 bit int to write
+            `force` (bool): send the word even if the LEDs already show it
 
         Requires:
-            `word_ui32` is in [0x0..0xFFFFFFFF]
+            `word_ui32` is in [0x0..0xFFFFFFFF], or [0, 2**NUM_LEDS) on a longer chain
 
         Side effects:
             illuminates LEDs that correspond to the set bits in `word_ui32`. The
@@ -106,26 +626,43 @@ class UI_LEDs:
             `write_multi(0x00000001)` -> the 0th LED lights up
             `write_multi(0x80000005)` -> the 0th, 2nd, and 31st LEDs light up
         '''
-        self.chip_sel.on()
-        self.spi._spi.transfer(
-            word_ui32.to_bytes(4, 'big')
-        )
-        self.chip_sel.off()
-        self._cached_write = word_ui32
+        with self._lock:
+            self._pack_word(self._frame, word_ui32)
+
+            if self._frame_owner is None:
+                self._send(force)
+
+    def write_masked(self, clear_mask: int, set_mask: int) -> None:
+        '''
+        `write_masked(c, s)` turns off the LEDs of the set bits in `c`, then turns
+        on the LEDs of the set bits in `s`, leaving all other LEDs alone. The
+        change is atomic with respect to writes from other threads.
+
+        Examples:
+            `write_masked(0x0000000F, 0x00000005)` -> LEDs 0 and 2 on, LEDs 1 and 3 off
+        '''
+        with self._lock:
+            current = int.from_bytes(self._frame, 'big')
+            self.write_multi((current & ~clear_mask) | set_mask)
 
     def write_single(self, led_num: int, state: int) -> None:
         '''
         `write_single(n, s)` sets the single LED at the given position `n` to 
         the given state `s`. The state of all other LEDs is left alone.
 
+        Only the byte holding the LED is changed, so the cost does not grow with
+        the length of the chain.
+
         Args:
-            `led_num` (int): the LED number to turn on, in [0..31]
+            `led_num` (int): the LED number to turn on, in [0..NUM_LEDS)
             `state` (int): the state to write, in [0..1]
 
         Requires:
-            `led_num` is an integer in [0..31]
             `state` is an integer in [0, 1]
 
+        Raises:
+            ValueError if `led_num` is not in [0..NUM_LEDS).
+
         Examples:
             `write_single(13, 1)` -> the 13th LED turns on if it was previously 
             off, or stays on if it was already on
@@ -133,9 +670,18 @@ class UI_LEDs:
             `write_single(3, 0)` -> the 3rd LED turns off if it was previously 
             on, or stays off if it was already off
         '''
-        val_to_write = self._cached_write & ~(1 << led_num)
-        val_to_write = val_to_write | (state << led_num)
-        self.write_multi(val_to_write)
+        if not 0 <= led_num < self.NUM_LEDS:
+            raise ValueError(f'led_num must be in [0..{self.NUM_LEDS})')
+
+        index = len(self._frame) - 1 - (led_num >> 3)
+        bit = 1 << (led_num & 7)
+        with self._lock:
+            if state:
+                self._frame[index] |= bit
+            else:
+                self._frame[index] &= ~bit
+            if self._frame_owner is None:
+                self._send()
 
     def single_on(self, led_num: int) -> None:
         '''
@@ -157,14 +703,712 @@ class UI_LEDs:
         '''
         self.write_multi(1 << led_num)
 
-    def all_off(self) -> None:
+    def all_off(self, force: bool = False) -> None:
         '''
         `all_off()` turns all the LEDs off
 
+        Args:
+            `force` (bool): send the word even if the LEDs are already off
+
         Side effects:
             turns all the LEDs off
         '''
-        self.write_multi(0x00000000)
+        self.write_multi(0x00000000, force)
+
+    def close(self) -> None:
+        '''
+        `close()` stops any fade and releases the transport and the PWM pin, the
+        LEDs keep their last pattern.
+        '''
+        with self._fade_cv:
+            self._fade = None
+            self._fade_stop = True
+            self._fade_cv.notify_all()
+        if self._fade_thread is not None:
+            self._fade_thread.join()
+
+        self.transport.close()
+        self.pwm.close()
+
+
+class AsyncLEDWriter:
+    '''
+    Non-blocking front end for UI_LEDs that can be used from coroutines and
+    threads alike.
+
+    Updates are merged into one pending edit, a (clear, set) pair of masks, and a
+    worker thread applies it with a single SPI transfer at most once every frame
+    interval. Updates made while a frame is being sent go into the next frame.
+    Each update returns a future that resolves once the frame holding it has been
+    sent, and can be awaited from a coroutine.
+    '''
+
+    def __init__(self, ui_leds: UI_LEDs, frame_interval_secs: float = 0.01) -> None:
+        '''
+        `AsyncLEDWriter(leds, secs)` writes to `leds` at most once every `secs`
+        seconds, its worker thread is started right away.
+        '''
+        self._leds = ui_leds
+        self._frame_interval_secs = frame_interval_secs
+        self._all_mask = (1 << ui_leds.NUM_LEDS) - 1
+
+        self._cv = threading.Condition()
+        self._clear_mask = 0
+        self._set_mask = 0
+        self._futures = []
+        self._stop = False
+        self._last_flush_t = 0.0
+
+        self._stats = {'updates': 0, 'frames': 0, 'errors': 0}
+
+        self._thread = threading.Thread(target=self._run, name='AsyncLEDWriter', daemon=True)
+        self._thread.start()
+
+    def write_masked(self, clear_mask: int, set_mask: int) -> Future:
+        '''
+        `write_masked(c, s)` queues turning off the LEDs of `c` and then turning on
+        the LEDs of `s`, see `UI_LEDs.write_masked()`.
+
+        Returns a concurrent.futures.Future, or an asyncio future when called from
+        a coroutine, that resolves when the update has been sent.
+
+        Raises:
+            RuntimeError if the writer has been closed.
+        '''
+        future = Future()
+        with self._cv:
+            if self._stop:
+                raise RuntimeError('the writer has been closed')
+
+            # applying (c1, s1) then (c2, s2) is the same as applying (c1 | c2, s1 & ~c2 | s2)
+            self._clear_mask |= clear_mask
+            self._set_mask = (self._set_mask & ~clear_mask) | set_mask
+            self._futures.append(future)
+            self._stats['updates'] += 1
+            self._cv.notify()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return future
+        return asyncio.wrap_future(future)
+
+    def write_multi(self, word_ui32: int) -> Future:
+        '''
+        `write_multi(w)` queues showing exactly the pattern `w`, see `write_masked()`.
+        '''
+        return self.write_masked(self._all_mask, word_ui32)
+
+    def write_single(self, led_num: int, state: int) -> Future:
+        '''
+        `write_single(n, s)` queues setting LED `n` to state `s`, see `write_masked()`.
+
+        Raises:
+            ValueError if `led_num` is not in [0..NUM_LEDS).
+        '''
+        if not 0 <= led_num < self._leds.NUM_LEDS:
+            raise ValueError(f'led_num must be in [0..{self._leds.NUM_LEDS})')
+        return self.write_masked(1 << led_num, state << led_num)
+
+    def get_stats(self) -> dict:
+        '''
+        `get_stats()` is the number of `updates` queued, the number of `frames`
+        they were merged into, and the number of frames that failed to send.
+        '''
+        return dict(self._stats)
+
+    def close(self) -> None:
+        '''
+        `close()` sends any pending update and stops the worker thread.
+        '''
+        with self._cv:
+            self._stop = True
+            self._cv.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._stop or self._futures)
+                if not self._futures:
+                    return
+
+                # wait out the frame interval, updates made meanwhile join this frame
+                while not self._stop:
+                    remaining = self._last_flush_t + self._frame_interval_secs - time.monotonic()
+                    if remaining <= 0.0:
+                        break
+                    self._cv.wait(remaining)
+
+                clear_mask, set_mask, futures = self._clear_mask, self._set_mask, self._futures
+                self._clear_mask = 0
+                self._set_mask = 0
+                self._futures = []
+
+            self._last_flush_t = time.monotonic()
+            try:
+                self._leds.write_masked(clear_mask, set_mask)
+            except Exception as e:
+                self._stats['errors'] += 1
+                self._resolve(futures, e)
+                continue
+
+            self._stats['frames'] += 1
+            self._resolve(futures)
+
+    @staticmethod
+    def _resolve(futures: list[Future], error: Optional[Exception] = None) -> None:
+        '''
+        `_resolve(futures, e)` fails every future in `futures` with `e`, or resolves
+        them if `e` is None. Futures that were cancelled, for example by an awaiting
+        coroutine timing out, are skipped.
+        '''
+        for future in futures:
+            try:
+                # a running future can no longer be cancelled from another thread
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+            except (InvalidStateError, RuntimeError):
+                # one bad future must not stop the writer
+                pass
+
+
+class LEDSequencer:
+    '''
+    Plays sequences of LED frames on a background thread.
+
+    A sequence is a list of (32 bit word, duration in seconds) frames. Every frame
+    is due at an absolute deadline on the monotonic clock, found by adding up
+    the durations, so the time spent writing to the chips or waiting for the GIL
+    never accumulates. A thread that falls a whole frame behind drops frames to
+    get back on schedule.
+
+    A new sequence can crossfade in from whatever the LEDs are showing. The
+    MAX6969 outputs are only on or off, so the fade is done with temporal
+    dithering: each LED that differs shows its new state for a growing share of
+    short dither periods.
+    '''
+
+    # how often the pattern is rewritten during a crossfade
+    DITHER_PERIOD_SECS = 0.002
+
+    # a frame shown later than this after its deadline counts as a deadline miss
+    LATE_TOLERANCE_SECS = 0.001
+
+    def __init__(self, ui_leds: UI_LEDs, dither_period_secs: float = DITHER_PERIOD_SECS) -> None:
+        '''
+        `LEDSequencer(leds)` is an idle sequencer that drives the UI LEDs `leds`,
+        its thread is started right away.
+
+        Args:
+            `ui_leds` (UI_LEDs): the LEDs to drive
+            `dither_period_secs` (float): the time between pattern writes in a crossfade
+        '''
+        self._leds = ui_leds
+        self._dither_period_secs = dither_period_secs
+
+        # play() and cancel() bump the generation, which stops whatever is playing
+        self._cv = threading.Condition()
+        self._generation = 0
+        self._pending = None
+        self._playing = False
+        self._stop = False
+
+        self._stats = {
+            'frames_shown': 0,
+            'frames_skipped': 0,
+            'deadline_misses': 0,
+            'dither_writes': 0,
+            'total_late_secs': 0.0,
+            'max_late_secs': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name='LEDSequencer', daemon=True)
+        self._thread.start()
+
+    def play(self, frames: list[tuple[int, float]], loop: bool = False, crossfade_secs: float = 0.0) -> None:
+        '''
+        `play(frames)` stops whatever is playing and starts the sequence `frames`.
+
+        Args:
+            `frames` (list[tuple[int, float]]): the (word, duration) frames, in order
+            `loop` (bool): start over after the last frame until cancelled
+            `crossfade_secs` (float): how long to fade from the current pattern
+                into the first frame, 0.0 switches straight away
+
+        Raises:
+            ValueError if there are no frames or a duration is not positive.
+        '''
+        words = tuple(word for word, _ in frames)
+        durations = tuple(float(secs) for _, secs in frames)
+        if not words:
+            raise ValueError('a sequence needs at least one frame')
+        if any(secs <= 0.0 for secs in durations):
+            raise ValueError('frame durations must be positive')
+
+        with self._cv:
+            self._generation += 1
+            self._pending = (words, durations, loop, crossfade_secs)
+            self._playing = True
+            self._cv.notify_all()
+
+    def cancel(self) -> None:
+        '''
+        `cancel()` stops whatever is playing, the LEDs keep the last frame shown.
+        '''
+        with self._cv:
+            self._generation += 1
+            self._pending = None
+            self._playing = False
+            self._cv.notify_all()
+
+    @property
+    def is_playing(self) -> bool:
+        '''
+        `is_playing` is true iff a sequence is playing or about to start.
+        '''
+        return self._playing
+
+    def wait(self, timeout: float = None) -> bool:
+        '''
+        `wait(t)` blocks for at most `t` seconds, or forever if `t` is None, until
+        nothing is playing, and is true iff nothing is playing.
+        A sequence has finished once its last frame has been shown for its duration.
+        '''
+        with self._cv:
+            return self._cv.wait_for(lambda: not self._playing, timeout)
+
+    def get_stats(self) -> dict:
+        '''
+        `get_stats()` is the timing record of every frame shown so far:
+
+            frames_shown    : frames written on time or late
+            frames_skipped  : frames dropped to catch up after falling behind
+            deadline_misses : frames shown more than LATE_TOLERANCE_SECS late
+            dither_writes   : pattern writes made while crossfading
+            mean_late_secs  : average time between a frame's deadline and its write
+            max_late_secs   : the worst of those times
+        '''
+        stats = dict(self._stats)
+        total_late_secs = stats.pop('total_late_secs')
+        stats['mean_late_secs'] = total_late_secs / max(1, stats['frames_shown'])
+        return stats
+
+    def close(self) -> None:
+        '''
+        `close()` stops whatever is playing and ends the sequencer's thread.
+        '''
+        with self._cv:
+            self._generation += 1
+            self._stop = True
+            self._playing = False
+            self._cv.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._stop or self._pending is not None)
+                if self._stop:
+                    return
+                words, durations, loop, crossfade_secs = self._pending
+                self._pending = None
+                generation = self._generation
+
+            if self._play(words, durations, loop, crossfade_secs, generation):
+                with self._cv:
+                    if self._generation == generation:
+                        self._playing = False
+                        self._cv.notify_all()
+
+    def _sleep_until(self, deadline: float, generation: int) -> bool:
+        '''
+        `_sleep_until(d, g)` blocks until the monotonic time `d` and is true, or
+        is false as soon as playback generation `g` has been replaced.
+        '''
+        with self._cv:
+            while self._generation == generation:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0.0:
+                    return True
+                self._cv.wait(remaining)
+            return False
+
+    def _play(
+        self,
+        words: tuple[int, ...],
+        durations: tuple[float, ...],
+        loop: bool,
+        crossfade_secs: float,
+        generation: int
+    ) -> bool:
+        '''
+        `_play(words, durations, loop, fade, g)` plays one sequence and is true iff
+        it ran to the end without being replaced.
+        '''
+        deadline = time.monotonic()
+        if crossfade_secs > 0.0:
+            if not self._crossfade(self._leds.get_pattern(), words[0], crossfade_secs, generation):
+                return False
+            deadline += crossfade_secs
+
+        num_frames = len(words)
+        i = 0
+        while True:
+            late = time.monotonic() - deadline
+
+            # a whole frame behind, drop frames rather than run the rest of the sequence late
+            while late >= durations[i] and (loop or i + 1 < num_frames):
+                deadline += durations[i]
+                late -= durations[i]
+                i = (i + 1) % num_frames
+                self._stats['frames_skipped'] += 1
+
+            self._leds.write_multi(words[i])
+
+            self._stats['frames_shown'] += 1
+            self._stats['total_late_secs'] += late
+            if late > self._stats['max_late_secs']:
+                self._stats['max_late_secs'] = late
+            if late > self.LATE_TOLERANCE_SECS:
+                self._stats['deadline_misses'] += 1
+
+            deadline += durations[i]
+            i += 1
+            if i == num_frames:
+                if not loop:
+                    return self._sleep_until(deadline, generation)
+                i = 0
+
+            if not self._sleep_until(deadline, generation):
+                return False
+
+    def _crossfade(self, old_word: int, new_word: int, secs: float, generation: int) -> bool:
+        '''
+        `_crossfade(old, new, secs, g)` dithers from `old` to `new` over `secs` seconds
+        and is true iff it was not replaced before it finished.
+
+        The share of dither periods showing `new` grows linearly. An accumulator
+        spreads those periods out evenly instead of bunching them together.
+        '''
+        start = time.monotonic()
+        deadline = start
+        level = 0.0
+        while deadline - start < secs:
+            level += (deadline - start) / secs
+            if level >= 1.0:
+                level -= 1.0
+                self._leds.write_multi(new_word)
+            else:
+                self._leds.write_multi(old_word)
+            self._stats['dither_writes'] += 1
+
+            deadline += self._dither_period_secs
+            if not self._sleep_until(deadline, generation):
+                return False
+        return True
+
+
+class BitAngleModulator:
+    '''
+    Per-LED brightness for the UI LEDs with bit-angle modulation.
+
+    Each LED's brightness is quantized to `bits` bits. Bitplane `k` is the 32 bit
+    word of the LEDs whose level has bit `k` set, and it is shown for
+    `base_period_secs * 2**k`, so over one refresh every LED is lit for a share of
+    the time equal to its level. The planes are precomputed whenever the levels
+    change, so the thread only writes words at deadlines.
+
+    While it runs the global PWM is held at full brightness and the modulator
+    owns the LED pattern. `stop()` falls back to the global PWM: the brightness
+    from before `start()` is restored and every LED with a level above 0 is lit.
+
+    The thread asks for real-time scheduling, which needs root or CAP_SYS_NICE,
+    and otherwise runs at normal priority. To hit the short plane deadlines it
+    sleeps until `spin_secs` before each one and then spins, the CPU this costs
+    is reported by `get_stats()`.
+    '''
+
+    # the real-time priority asked for by the modulator thread
+    SCHED_PRIORITY = 50
+
+    def __init__(
+        self,
+        ui_leds: UI_LEDs,
+        bits: int = 4,
+        base_period_secs: float = 0.0005,
+        spin_secs: float = 0.0002
+    ) -> None:
+        '''
+        `BitAngleModulator(leds)` is a stopped modulator for the UI LEDs `leds`
+        with every LED at level 0.
+
+        Args:
+            `ui_leds` (UI_LEDs): the LEDs to drive
+            `bits` (int): brightness resolution, there are 2**bits levels
+            `base_period_secs` (float): how long the least significant plane is shown,
+                a refresh takes `base_period_secs * (2**bits - 1)`
+            `spin_secs` (float): how long before a deadline the thread stops sleeping
+
+        Raises:
+            ValueError if `bits` is not in [1..8] or `base_period_secs` is not positive.
+        '''
+        if not 1 <= bits <= 8:
+            raise ValueError('bits must be in [1..8]')
+        if base_period_secs <= 0.0:
+            raise ValueError('base_period_secs must be positive')
+
+        self._leds = ui_leds
+        self._bits = bits
+        self._max_level = (1 << bits) - 1
+        self._plane_secs = tuple(base_period_secs * (1 << k) for k in range(bits))
+        self._refresh_secs = base_period_secs * self._max_level
+        self._spin_secs = spin_secs
+
+        self._levels = [0] * ui_leds.NUM_LEDS
+        # the thread only ever reads this reference, so the planes of a refresh always match
+        self._planes = (0,) * bits
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._saved_brightness = None
+
+        self._stats = {
+            'refreshes': 0,
+            'overruns': 0,
+            'realtime': False,
+            'run_secs': 0.0,
+            'cpu_secs': 0.0,
+        }
+
+    def set_levels(self, levels: list[float]) -> None:
+        '''
+        `set_levels(b)` sets the brightness of every LED, `b[n]` is the level of
+        LED `n` and levels are clamped to [0.0, 1.0]. It takes effect at the start
+        of the next refresh.
+
+        Raises:
+            ValueError if `levels` does not have an entry for every LED.
+        '''
+        if len(levels) != self._leds.NUM_LEDS:
+            raise ValueError(f'there must be exactly {self._leds.NUM_LEDS} levels')
+
+        self._levels = [round(min(max(level, 0.0), 1.0) * self._max_level) for level in levels]
+        self._build_planes()
+
+    def set_level(self, led_num: int, level: float) -> None:
+        '''
+        `set_level(n, b)` sets the brightness of LED `n` to `b`, clamped to [0.0, 1.0].
+
+        Raises:
+            ValueError if `led_num` is not in [0..NUM_LEDS).
+        '''
+        if not 0 <= led_num < self._leds.NUM_LEDS:
+            raise ValueError(f'led_num must be in [0..{self._leds.NUM_LEDS})')
+
+        self._levels[led_num] = round(min(max(level, 0.0), 1.0) * self._max_level)
+        self._build_planes()
+
+    def _build_planes(self) -> None:
+        planes = [0] * self._bits
+        for led_num, level in enumerate(self._levels):
+            for k in range(self._bits):
+                if (level >> k) & 1:
+                    planes[k] |= 1 << led_num
+        self._planes = tuple(planes)
+
+    @property
+    def is_running(self) -> bool:
+        '''
+        `is_running` is true iff the modulator thread is driving the LEDs.
+        '''
+        return self._thread is not None
+
+    def start(self) -> None:
+        '''
+        `start()` sets the global PWM to full brightness and starts modulating.
+        Does nothing if the modulator is already running.
+        '''
+        if self._thread is not None:
+            return
+
+        self._saved_brightness = self._leds.pwm.value
+        self._leds.set_brightness(1.0)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='BitAngleModulator', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''
+        `stop()` stops modulating and falls back to the global PWM brightness that
+        was set before `start()`, with every LED above level 0 lit.
+        Does nothing if the modulator is not running.
+        '''
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+        lit = 0
+        for led_num, level in enumerate(self._levels):
+            if level:
+                lit |= 1 << led_num
+        self._leds.write_multi(lit)
+        self._leds.set_brightness(self._saved_brightness)
+
+    def get_stats(self) -> dict:
+        '''
+        `get_stats()` is the achieved performance of the modulator:
+
+            refreshes   : refreshes completed
+            overruns    : refreshes that ran more than a whole refresh late and
+                          restarted their schedule
+            realtime    : true iff the thread got real-time scheduling
+            refresh_hz  : refreshes per second of running time
+            target_hz   : the refresh rate asked for
+            cpu_percent : CPU time used by the thread, as a share of its running time
+        '''
+        stats = dict(self._stats)
+        run_secs = stats.pop('run_secs')
+        cpu_secs = stats.pop('cpu_secs')
+        stats['refresh_hz'] = stats['refreshes'] / run_secs if run_secs else 0.0
+        stats['target_hz'] = 1.0 / self._refresh_secs
+        stats['cpu_percent'] = 100.0 * cpu_secs / run_secs if run_secs else 0.0
+        return stats
+
+    def _raise_priority(self) -> bool:
+        '''
+        `_raise_priority()` asks for real-time scheduling of the calling thread and
+        is true iff it was granted.
+        '''
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.SCHED_PRIORITY))
+        except (AttributeError, OSError):
+            return False
+        return True
+
+    def _wait_until(self, deadline: float) -> None:
+        remaining = deadline - time.monotonic()
+        if remaining > self._spin_secs:
+            time.sleep(remaining - self._spin_secs)
+        while time.monotonic() < deadline:
+            pass
+
+    def _run(self) -> None:
+        self._stats['realtime'] = self._raise_priority()
+
+        start_t = time.monotonic()
+        start_cpu = time.thread_time()
+        run_secs = self._stats['run_secs']
+        cpu_secs = self._stats['cpu_secs']
+
+        deadline = start_t
+        while not self._stop_event.is_set():
+            for word, secs in zip(self._planes, self._plane_secs):
+                self._leds.write_multi(word)
+                deadline += secs
+                self._wait_until(deadline)
+
+            self._stats['refreshes'] += 1
+
+            # a whole refresh behind, start a fresh schedule rather than rush to catch up
+            now = time.monotonic()
+            if now - deadline > self._refresh_secs:
+                deadline = now
+                self._stats['overruns'] += 1
+
+            self._stats['run_secs'] = run_secs + now - start_t
+            self._stats['cpu_secs'] = cpu_secs + time.thread_time() - start_cpu
+
+
+def measure_frame_rate(ui_leds: UI_LEDs, duration_secs: float = 1.0) -> float:
+    '''
+    `measure_frame_rate(leds, secs)` is the number of frames per second that
+    `leds` can send, measured by writing a changing word for `secs` seconds.
+    '''
+    all_leds = (1 << ui_leds.NUM_LEDS) - 1
+    num_frames = 0
+    start = time.perf_counter()
+    stop = start + duration_secs
+    while time.perf_counter() < stop:
+        for _ in range(100):
+            num_frames += 1
+            ui_leds.write_multi(num_frames & all_leds)
+    return num_frames / (time.perf_counter() - start)
+
+
+def measure_single_rate(ui_leds: UI_LEDs, duration_secs: float = 1.0) -> float:
+    '''
+    `measure_single_rate(leds, secs)` is the number of `write_single()` frames per
+    second that `leds` can send, toggling the LEDs in turn for `secs` seconds.
+    Only the frames actually sent are counted.
+    '''
+    num_passes = 0
+    num_transfers = ui_leds.get_num_transfers()
+    start = time.perf_counter()
+    stop = start + duration_secs
+    while time.perf_counter() < stop:
+        # every pass flips each LED, so every write changes the frame
+        num_passes += 1
+        for led_num in range(ui_leds.NUM_LEDS):
+            ui_leds.write_single(led_num, num_passes & 1)
+    return (ui_leds.get_num_transfers() - num_transfers) / (time.perf_counter() - start)
+
+
+def do_chain_benchmark(duration_secs=0.5, max_chips=16):
+    '''
+    Print the frames per second of `write_multi()` and `write_single()` against the
+    length of the MAX6969 chain, with the mock transport so only the Python cost
+    is measured.
+    '''
+
+    DEMO_PWM_PIN = 12
+
+    num_chips = 1
+    while num_chips <= max_chips:
+        ui_leds = UI_LEDs(
+            None, None, DEMO_PWM_PIN, transport=MockSPITransport(keep_frames=False), num_chips=num_chips)
+        multi = measure_frame_rate(ui_leds, duration_secs)
+        single = measure_single_rate(ui_leds, duration_secs)
+        print(f'{num_chips:3d} chips: {multi:9.0f} multi/sec {single:9.0f} single/sec')
+        ui_leds.close()
+        num_chips *= 2
+
+
+def do_transport_benchmark(duration_secs=1.0):
+    '''
+    Print the frames per second of each SPI transport that can be opened here.
+    '''
+
+    DEMO_CHIP_SELECT_PIN = 17
+    DEMO_PWM_PIN = 12
+
+    backends = [
+        ('mock', lambda: MockSPITransport(keep_frames=False)),
+        ('gpiozero', lambda: GpiozeroSPITransport(gpiozero.SPIDevice(), DEMO_CHIP_SELECT_PIN)),
+        ('spidev, hardware CS', lambda: SpidevTransport()),
+        ('spidev, GPIO CS', lambda: SpidevTransport(device=1, cs_pin=DEMO_CHIP_SELECT_PIN)),
+    ]
+
+    for name, make_transport in backends:
+        try:
+            transport = make_transport()
+        except Exception as e:
+            print(f'{name}: unavailable ({e!r})')
+            continue
+
+        ui_leds = UI_LEDs(None, None, DEMO_PWM_PIN, transport=transport)
+        print(f'{name}: {measure_frame_rate(ui_leds, duration_secs):.0f} frames/sec')
+        ui_leds.close()
 
 
 def do_demo(duration_secs, delay_secs):
@@ -179,18 +1423,49 @@ def do_demo(duration_secs, delay_secs):
 
     ui_leds.set_brightness(0.1)
 
-    counter = 0
+    # each LED is lit for one delay and then everything is off for one delay
+    frames = []
+    for led_num in range(UI_LEDs.NUM_LEDS):
+        frames.append((1 << led_num, delay_secs))
+        frames.append((0x00000000, delay_secs))
 
-    STOP_TIME = time.monotonic() + duration_secs
+    sequencer = LEDSequencer(ui_leds)
+    sequencer.play(frames, loop=True)
+    time.sleep(duration_secs)
+    sequencer.close()
 
-    while time.monotonic() < STOP_TIME:
-        ui_leds.single_on(counter)
-        counter += 1
-        counter &= UI_LEDs.NUM_LEDS - 1
-        time.sleep(delay_secs)
+    print(sequencer.get_stats())
 
-        ui_leds.all_off()
-        time.sleep(delay_secs)
+
+def do_bam_demo(duration_secs):
+    '''
+    Do a demo of per-LED brightness, a ramp from dark to bright across the LEDs,
+    and print the refresh rate and CPU cost at a few base periods.
+    '''
+
+    DEMO_CHIP_SELECT_PIN = 17
+    DEMO_PWM_PIN = 12
+
+    ui_leds = UI_LEDs(gpiozero.SPIDevice(), DEMO_CHIP_SELECT_PIN, DEMO_PWM_PIN)
+
+    ui_leds.set_brightness(0.1)
+
+    levels = [led_num / (UI_LEDs.NUM_LEDS - 1) for led_num in range(UI_LEDs.NUM_LEDS)]
+
+    for base_period_secs in (0.002, 0.001, 0.0005, 0.00025):
+        bam = BitAngleModulator(ui_leds, base_period_secs=base_period_secs)
+        bam.set_levels(levels)
+        bam.start()
+        time.sleep(duration_secs)
+        bam.stop()
+
+        stats = bam.get_stats()
+        print(
+            f"base {base_period_secs * 1e6:.0f} us: "
+            f"{stats['refresh_hz']:.0f} of {stats['target_hz']:.0f} Hz, "
+            f"{stats['cpu_percent']:.0f}% CPU, {stats['overruns']} overruns, "
+            f"realtime {stats['realtime']}"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+'''
+Mirrors the UI switches onto the UI LEDs, so the voltage lamps follow the
+voltage switches.
+
+Prereqs:
+- the switch board and LED board libraries, in ./switch_board and ./led_board
+
+- this is intended to be installed on a Raspberry Pi, see the prereqs of both
+  libraries
+
+'''
+from collections import deque
+from typing import Callable, Optional
+import time
+
+
+def level_bar(word: int, snapshot, pending: int, now_secs: float) -> int:
+    '''
+    `level_bar(w, snap, p, t)` is the word `w` with every lamp up to the shock level
+    of `snap` lit, like a bar graph.
+    '''
+    return word | ((1 << snapshot.shock_level) - 1)
+
+
+def mirror_down(word: int, snapshot, pending: int, now_secs: float) -> int:
+    '''
+    `mirror_down(w, snap, p, t)` is the word `w` with the lamp of every DOWN
+    voltage switch in `snap` lit.
+    '''
+    return word | snapshot.down_mask
+
+
+def blink_pending(period_secs: float = 0.25) -> Callable:
+    '''
+    `blink_pending(secs)` is a rule that blinks the lamps of the switches in the
+    pending mask with period `secs`, on top of whatever the earlier rules lit.
+
+    The blink only moves on when a snapshot arrives. While a switch is settling
+    UI_Switches reads every debounce period, so a pending lamp keeps blinking
+    until its switch settles.
+    '''
+    half_period_secs = period_secs / 2.0
+
+    def rule(word: int, snapshot, pending: int, now_secs: float) -> int:
+        if int(now_secs / half_period_secs) & 1:
+            return word & ~pending
+        return word | pending
+
+    return rule
+
+
+class PanelMirror:
+    '''
+    Lights the UI LEDs from the UI switch snapshots.
+
+    Each snapshot is passed through a list of rules, each one a function
+    `rule(word, snapshot, pending, now_secs)` that is the lamp word after the
+    rule. The rules start from 0 and work only on the snapshot's bit masks, so no
+    per-switch lists are built. The resulting word is written with one
+    `write_masked()` call. UI_LEDs skips the write when the lamps already show it,
+    so there is at most one SPI frame per change.
+
+    Use `on_snapshot` as the `snapshot_callback` of UI_Switches and then `bind()`
+    the switches. The time from the interrupt edge, or from the read when the
+    edge has no timestamp, to the end of the SPI write is measured for every
+    change. So is the time spent in the mirror itself.
+
+    The mirror only touches the lamps in its lamp mask, by default one lamp for
+    each voltage switch, so other lamps can be driven by other code.
+    '''
+
+    # the number of recent latencies kept for the percentiles in `get_stats()`
+    MAX_LATENCY_SAMPLES = 1024
+
+    def __init__(self, ui_leds, rules: Optional[list[Callable]] = None, lamp_mask: Optional[int] = None) -> None:
+        '''
+        `PanelMirror(leds)` lights a level bar on the UI LEDs `leds`.
+
+        Args:
+            `ui_leds` (UI_LEDs): the LEDs to light
+            `rules` (list): the rules to apply in order, defaults to `[level_bar]`
+            `lamp_mask` (int): the lamps the mirror owns, lamp i is LED i. Defaults
+                to the lamps of the voltage switches.
+        '''
+        self._leds = ui_leds
+        self._rules = list(rules) if rules is not None else [level_bar]
+        self._lamp_mask = lamp_mask
+        self._switches = None
+
+        self._last_seq = None
+        self._latencies_ns = deque(maxlen=self.MAX_LATENCY_SAMPLES)
+        self._mirror_ns = deque(maxlen=self.MAX_LATENCY_SAMPLES)
+        self._stats = {'snapshots': 0, 'frames': 0}
+
+    def bind(self, ui_switches) -> None:
+        '''
+        `bind(sw)` takes the pending mask from the UI switches `sw` and draws their
+        current snapshot. Without a binding the pending mask is always 0.
+        '''
+        self._switches = ui_switches
+        self.on_snapshot(ui_switches.get_snapshot())
+
+    def on_snapshot(self, snapshot) -> None:
+        '''
+        `on_snapshot(snap)` lights the lamps for the SwitchSnapshot `snap`.
+        '''
+        start_ns = time.monotonic_ns()
+
+        pending = 0
+        if self._switches is not None:
+            pending = self._switches.get_pending_mask()
+
+        now_secs = start_ns / 1e9
+        word = 0
+        for rule in self._rules:
+            word = rule(word, snapshot, pending, now_secs)
+
+        lamp_mask = self._lamp_mask
+        if lamp_mask is None:
+            lamp_mask = (1 << snapshot.num_v_switches) - 1
+
+        num_transfers = self._leds.get_num_transfers()
+        self._leds.write_masked(lamp_mask, word & lamp_mask)
+        end_ns = time.monotonic_ns()
+
+        self._stats['snapshots'] += 1
+        if self._leds.get_num_transfers() != num_transfers:
+            self._stats['frames'] += 1
+            self._mirror_ns.append(end_ns - start_ns)
+
+            # only the first frame for a new switch state was caused by its edge
+            origin_ns = snapshot.edge_t_ns if snapshot.edge_t_ns is not None else snapshot.read_t_ns
+            if snapshot.seq != self._last_seq and origin_ns:
+                self._latencies_ns.append(end_ns - origin_ns)
+
+        self._last_seq = snapshot.seq
+
+    def get_stats(self) -> dict:
+        '''
+        `get_stats()` is a summary of the mirror's work:
+
+            snapshots  : snapshots seen
+            frames     : snapshots that led to an SPI frame
+            latency_us : interrupt edge, or read, to SPI write done, for new switch states
+            mirror_us  : time spent in `on_snapshot()` for each frame sent
+
+        Each latency is a dict of `count`, `p50`, `p99` and `max` in microseconds over
+        the last MAX_LATENCY_SAMPLES samples, the percentiles are None without samples.
+        '''
+        stats = dict(self._stats)
+        stats['latency_us'] = self._summarize(self._latencies_ns)
+        stats['mirror_us'] = self._summarize(self._mirror_ns)
+        return stats
+
+    @staticmethod
+    def _summarize(samples_ns: deque) -> dict:
+        samples = sorted(samples_ns)
+        if not samples:
+            return {'count': 0, 'p50': None, 'p99': None, 'max': None}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] / 1e3
+
+        return {
+            'count': len(samples),
+            'p50': percentile(0.50),
+            'p99': percentile(0.99),
+            'max': samples[-1] / 1e3,
+        }
+
+
+def do_demo(duration_secs=60):
+    '''
+    Do a demo that lights a level bar for the shock level, blinks the lamps of
+    switches that are still settling, and prints the latency.
+    '''
+    import os
+    import sys
+
+    import gpiozero
+    import smbus
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [os.path.join(here, 'switch_board'), os.path.join(here, 'led_board')]
+    from switch_board_lib import UI_Switches
+    from led_board_lib import UI_LEDs
+
+    I2C_CHANNEL = 1
+    INTERRUPT_PIN = 19
+    CHIP_SELECT_PIN = 17
+    PWM_PIN = 12
+
+    ui_leds = UI_LEDs(gpiozero.SPIDevice(), CHIP_SELECT_PIN, PWM_PIN)
+    ui_leds.set_brightness(0.1)
+
+    mirror = PanelMirror(ui_leds, rules=[level_bar, blink_pending()])
+
+    # the kernel timestamps the edges, so the latency includes the time before the read
+    ui_switches = UI_Switches(
+        smbus.SMBus(I2C_CHANNEL), 0x20, 0x22, 0x21, 0x23, INTERRUPT_PIN,
+        snapshot_callback=mirror.on_snapshot,
+        debounce_settle_secs=0.02,
+        interrupt_backend=UI_Switches.InterruptBackend.GPIOD
+    )
+    mirror.bind(ui_switches)
+
+    STOP_TIME = time.monotonic() + duration_secs
+    while time.monotonic() < STOP_TIME:
+        time.sleep(5)
+        print(mirror.get_stats())
+
+    ui_switches.close()
+    ui_leds.close()
+
+
+if __name__ == "__main__":
+    do_demo()
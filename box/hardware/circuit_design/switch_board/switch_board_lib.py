@@ -16,11 +16,813 @@ Prereqs:
     - sudo i2cdetect -y 1
     - you should see the address of the I2C devices on the bus in the grid
 '''
-from typing import Callable
+from typing import AsyncIterator, Callable, Optional
+from collections import deque
+from concurrent.futures import Future
+import asyncio
+import heapq
 import gpiozero
+import threading
 import time
 import smbus
 from enum import Enum
+import mmap
+import os
+import select
+import struct
+
+try:
+    # smbus2 provides combined i2c_rdwr transfers, python3-smbus does not
+    from smbus2 import i2c_msg
+except ImportError:
+    i2c_msg = None
+
+try:
+    # libgpiod v2 bindings, for kernel timestamped edge events
+    import gpiod
+    from gpiod.line import Bias, Edge, Value
+except ImportError:
+    gpiod = None
+
+
+class I2CBusManager:
+    '''
+    Owner of an I2C bus that is shared by several drivers.
+
+    Drivers get an I2CBusClient from `client()` and use it in place of a raw
+    SMBus object. Every transaction is queued and run by a single worker thread,
+    so transactions from different drivers (and from different threads of one
+    driver) never interleave on the bus.
+
+    Queued transactions run in priority order, oldest first within a priority,
+    so switch reads are not held up behind background traffic. When several
+    register block reads of the same priority are queued back to back and the
+    bus supports i2c_rdwr they are merged into one combined transfer.
+    '''
+
+    class Priority(Enum):
+        '''
+        Enumerated transaction priorities, lower values run first.
+        '''
+        HIGH = 0
+        NORMAL = 1
+        BACKGROUND = 2
+
+    # the most block reads merged into a single i2c_rdwr call
+    MAX_MERGED_READS = 16
+
+    def __init__(self, bus) -> None:
+        '''
+        `I2CBusManager(bus)` manages the I2C bus `bus`, which is either an already
+        open SMBus object or the number of the I2C channel to open.
+
+        Side effects:
+            starts the worker thread
+        '''
+        self._bus = smbus.SMBus(bus) if isinstance(bus, int) else bus
+        self._can_merge = i2c_msg is not None and hasattr(self._bus, 'i2c_rdwr')
+
+        self._queue = []
+        self._queue_cv = threading.Condition()
+        self._seq = 0
+        self._closed = False
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'transactions': 0,
+            'bus_calls': 0,
+            'merged_reads': 0,
+            'max_queue_depth': 0,
+        }
+        self._client_stats = {}
+
+        self._thread = threading.Thread(target=self._run, name='I2CBusManager', daemon=True)
+        self._thread.start()
+
+    def client(self, name: str, priority: Priority = Priority.NORMAL) -> 'I2CBusClient':
+        '''
+        `client(name, p)` is a new SMBus-like handle whose transactions are queued
+        with priority `p` and accounted to `name`.
+        '''
+        with self._stats_lock:
+            self._client_stats.setdefault(name, {'transactions': 0, 'bus_secs': 0.0})
+        return I2CBusClient(self, name, priority)
+
+    def submit(self, client: 'I2CBusClient', op: str, args: tuple) -> Future:
+        '''
+        `submit(client, op, args)` queues the call `op(*args)` on the bus and is a
+        Future for its result.
+
+        Raises:
+            RuntimeError if the manager has been closed.
+        '''
+        future = Future()
+        with self._queue_cv:
+            if self._closed:
+                raise RuntimeError('I2CBusManager is closed')
+            heapq.heappush(self._queue, (client.priority.value, self._seq, client.name, op, args, future))
+            self._seq += 1
+            depth = len(self._queue)
+            self._queue_cv.notify()
+        with self._stats_lock:
+            self._stats['max_queue_depth'] = max(depth, self._stats['max_queue_depth'])
+        return future
+
+    def get_queue_depth(self) -> int:
+        '''
+        `get_queue_depth()` is the number of transactions waiting for the bus.
+        '''
+        with self._queue_cv:
+            return len(self._queue)
+
+    def get_stats(self) -> dict:
+        '''
+        `get_stats()` is a copy of the bus counters:
+
+            transactions    : transactions run for all clients
+            bus_calls       : calls made on the bus, merged reads count once
+            merged_reads    : block reads that shared an i2c_rdwr call with others
+            max_queue_depth : the deepest the queue has been
+            queue_depth     : the current queue depth
+            clients         : per-client transaction counts and time spent on the
+                              bus in seconds, merged transfers are split evenly
+        '''
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['clients'] = {name: dict(c) for name, c in self._client_stats.items()}
+        stats['queue_depth'] = self.get_queue_depth()
+        return stats
+
+    def close(self) -> None:
+        '''
+        `close()` runs every transaction that is already queued, stops the worker
+        thread and closes the bus.
+        '''
+        with self._queue_cv:
+            self._closed = True
+            self._queue_cv.notify()
+        self._thread.join()
+        if hasattr(self._bus, 'close'):
+            self._bus.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._queue_cv:
+                while not self._queue and not self._closed:
+                    self._queue_cv.wait()
+                if not self._queue:
+                    return
+
+                batch = [heapq.heappop(self._queue)]
+                if self._can_merge and batch[0][3] == 'read_i2c_block_data':
+                    # take the block reads of the same priority that are next in line, whatever
+                    # their client, so a low priority read never delays a high priority one
+                    while (self._queue and self._queue[0][0] == batch[0][0]
+                           and self._queue[0][3] == 'read_i2c_block_data'
+                           and len(batch) < self.MAX_MERGED_READS):
+                        batch.append(heapq.heappop(self._queue))
+
+            if len(batch) > 1:
+                self._run_merged(batch)
+            else:
+                self._run_single(batch[0])
+
+    def _run_single(self, item: tuple) -> None:
+        _, _, name, op, args, future = item
+        start = time.perf_counter()
+        try:
+            result = getattr(self._bus, op)(*args)
+        except Exception as e:
+            result = None
+            future.set_exception(e)
+        self._account([name], time.perf_counter() - start, merged=False)
+        if not future.done():
+            future.set_result(result)
+
+    def _run_merged(self, batch: list[tuple]) -> None:
+        msgs = []
+        for _, _, _, _, (addr, reg, length), _ in batch:
+            msgs.append(i2c_msg.write(addr, [reg]))
+            msgs.append(i2c_msg.read(addr, length))
+
+        start = time.perf_counter()
+        try:
+            self._bus.i2c_rdwr(*msgs)
+        except Exception:
+            # a combined transfer can't say which device failed, run them one by one
+            for item in batch:
+                self._run_single(item)
+            return
+        self._account([item[2] for item in batch], time.perf_counter() - start, merged=True)
+
+        for item, read_msg in zip(batch, msgs[1::2]):
+            item[5].set_result(list(read_msg))
+
+    def _account(self, names: list[str], bus_secs: float, merged: bool) -> None:
+        with self._stats_lock:
+            self._stats['transactions'] += len(names)
+            self._stats['bus_calls'] += 1
+            if merged:
+                self._stats['merged_reads'] += len(names)
+            for name in names:
+                client_stats = self._client_stats[name]
+                client_stats['transactions'] += 1
+                client_stats['bus_secs'] += bus_secs / len(names)
+
+
+class I2CBusClient:
+    '''
+    SMBus-like handle on an I2CBusManager, made with `I2CBusManager.client()`.
+
+    Each call is queued on the manager and blocks until the worker thread has run
+    it, so it can be passed to a driver in place of a raw SMBus object. Like the
+    bus itself, the client only has `i2c_rdwr` if the managed bus supports it.
+    '''
+
+    def __init__(self, manager: I2CBusManager, name: str, priority: I2CBusManager.Priority) -> None:
+        self._manager = manager
+        self.name = name
+        self.priority = priority
+
+        # drivers check for i2c_rdwr with hasattr(), so only offer it when it can work
+        if manager._can_merge:
+            self.i2c_rdwr = self._i2c_rdwr
+
+    def _call(self, op: str, *args):
+        return self._manager.submit(self, op, args).result()
+
+    def read_byte(self, addr: int) -> int:
+        return self._call('read_byte', addr)
+
+    def read_byte_data(self, addr: int, reg: int) -> int:
+        return self._call('read_byte_data', addr, reg)
+
+    def write_byte_data(self, addr: int, reg: int, value: int) -> None:
+        return self._call('write_byte_data', addr, reg, value)
+
+    def read_i2c_block_data(self, addr: int, reg: int, length: int) -> list[int]:
+        return self._call('read_i2c_block_data', addr, reg, length)
+
+    def write_i2c_block_data(self, addr: int, reg: int, data: list[int]) -> None:
+        return self._call('write_i2c_block_data', addr, reg, data)
+
+    def _i2c_rdwr(self, *msgs) -> None:
+        return self._call('i2c_rdwr', *msgs)
+
+
+class CoalescingDispatcher:
+    '''
+    Runs a consumer on its own thread, always with the newest item offered.
+
+    `offer()` never blocks on the consumer: it drops the item into a single
+    slot and returns. If the consumer is still busy with an earlier item when a
+    new one arrives, the item already waiting in the slot is replaced and
+    counted as dropped, so a slow consumer sees fewer, but always current, states.
+    '''
+
+    def __init__(self, consumer: Callable, name: str = 'CoalescingDispatcher') -> None:
+        '''
+        `CoalescingDispatcher(f)` calls `f(item)` on a new thread for the latest item
+        offered.
+
+        Side effects:
+            starts the dispatcher thread
+        '''
+        self._consumer = consumer
+        self._cv = threading.Condition()
+        self._slot = None
+        self._has_item = False
+        self._closed = False
+        self._stats = {
+            'offered': 0,
+            'delivered': 0,
+            'dropped': 0,
+            'consumer_errors': 0,
+            'max_consumer_secs': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def offer(self, item) -> None:
+        '''
+        `offer(item)` hands `item` to the consumer, replacing any item it has not
+        picked up yet.
+        '''
+        with self._cv:
+            self._stats['offered'] += 1
+            if self._has_item:
+                self._stats['dropped'] += 1
+            self._slot = item
+            self._has_item = True
+            self._cv.notify()
+
+    def get_stats(self) -> dict:
+        '''
+        `get_stats()` is a copy of the dispatch counters: items offered, delivered
+        and dropped, consumer calls that raised, and the slowest consumer call.
+        '''
+        with self._cv:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        '''
+        `close()` delivers any waiting item and stops the dispatcher thread.
+        '''
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                while not self._has_item and not self._closed:
+                    self._cv.wait()
+                if not self._has_item:
+                    return
+                item = self._slot
+                self._slot = None
+                self._has_item = False
+
+            start = time.perf_counter()
+            try:
+                self._consumer(item)
+            except Exception:
+                with self._cv:
+                    self._stats['consumer_errors'] += 1
+            elapsed = time.perf_counter() - start
+
+            with self._cv:
+                self._stats['delivered'] += 1
+                self._stats['max_consumer_secs'] = max(elapsed, self._stats['max_consumer_secs'])
+
+
+class PCA9555:
+    '''
+    Register level driver for one PCA9555D 16 bit I2C GPIO expander.
+
+    The chip has four pairs of 8 bit registers, one for each port. Every register
+    is handled here as a 16 bit word with port 0 in the low byte.
+
+    The driver keeps a shadow copy of every register it has written or read
+    back, so writes of a value the chip already holds are skipped. After a
+    brown-out the chip silently returns to its power-on defaults, which
+    `verify()` detects by reading back only the registers whose wanted value
+    differs from the default, and then repairs.
+    '''
+    INPUT_PORT_0 = 0
+    OUTPUT_PORT_0 = 2
+    POLARITY_PORT_0 = 4
+    CONFIG_PORT_0 = 6
+
+    # register contents after power on, and so after a brown-out
+    POWER_ON_DEFAULTS = {
+        OUTPUT_PORT_0: 0xFFFF,
+        POLARITY_PORT_0: 0x0000,
+        CONFIG_PORT_0: 0xFFFF,
+    }
+
+    def __init__(self, bus: smbus.SMBus, addr: int, polarity: int = 0x0000, direction: int = 0xFFFF) -> None:
+        '''
+        `PCA9555(bus, addr, pol, dir)` is the driver for the chip at address `addr`
+        that should hold the polarity inversion word `pol` and configuration word
+        `dir`. Nothing is sent to the chip until `verify()` is called.
+
+        Args:
+            `bus`: the I2C device to use
+            `addr`: the chip's I2C address
+            `polarity`: set bits invert the matching input, so a grounded pin reads 1
+            `direction`: set bits make the matching pin an input
+        '''
+        self._bus = bus
+        self.addr = addr
+
+        self._wanted = {
+            self.POLARITY_PORT_0: polarity,
+            self.CONFIG_PORT_0: direction,
+        }
+        self._shadow = {}
+
+        # set whenever the chip's registers may no longer match the shadow copy
+        self.needs_verify = True
+        self._configured = False
+
+        self.num_transactions = 0
+        self.stats = {'writes': 0, 'writes_skipped': 0, 'verify_reads': 0, 'repairs': 0}
+
+    def read_register(self, reg: int) -> int:
+        '''
+        `read_register(reg)` is the 16 bit word in the register pair starting at
+        `reg`, read in one transaction.
+
+        Raises:
+            OSError if there is a problem reading the chip.
+        '''
+        self.num_transactions += 1
+        bits_0_to_7, bits_8_to_15 = self._bus.read_i2c_block_data(self.addr, reg, 2)
+        return bits_8_to_15 << 8 | bits_0_to_7
+
+    def write_register(self, reg: int, word: int) -> None:
+        '''
+        `write_register(reg, w)` writes the 16 bit word `w` to the register pair
+        starting at `reg`, unless the shadow copy shows the chip already holds it.
+
+        Raises:
+            OSError if there is a problem writing the chip.
+        '''
+        if self._shadow.get(reg) == word:
+            self.stats['writes_skipped'] += 1
+            return
+
+        # forget the old value first, a failed write leaves the register unknown
+        self._shadow.pop(reg, None)
+        self.num_transactions += 1
+        self._bus.write_i2c_block_data(self.addr, reg, [word & 0xFF, word >> 8])
+        self.stats['writes'] += 1
+        self._shadow[reg] = word
+
+    def verify(self) -> bool:
+        '''
+        `verify()` makes sure the chip holds the wanted polarity and configuration
+        words, and is true iff it already did.
+
+        A register whose wanted word equals its power-on default is only read if
+        its contents are unknown, since a brown-out would leave it unchanged.
+
+        Raises:
+            OSError if there is a problem talking to the chip, `needs_verify`
+            stays set in that case.
+        '''
+        ok = True
+        for reg, word in self._wanted.items():
+            if reg in self._shadow and word == self.POWER_ON_DEFAULTS[reg]:
+                continue
+
+            self.stats['verify_reads'] += 1
+            actual = self.read_register(reg)
+            if actual != word:
+                ok = False
+            self._shadow[reg] = actual
+
+        if not ok:
+            # a mismatch on the first check is just the chip's power-on state
+            if self._configured:
+                self.stats['repairs'] += 1
+            for reg, word in self._wanted.items():
+                self.write_register(reg, word)
+
+        self._configured = True
+        self.needs_verify = False
+        return ok
+
+    def check(self, reg: int) -> bool:
+        '''
+        `check(reg)` reads back the register pair starting at `reg` and is true iff
+        it holds the wanted word. On a mismatch the chip is repaired with `verify()`.
+
+        Raises:
+            OSError if there is a problem talking to the chip.
+        '''
+        self.stats['verify_reads'] += 1
+        actual = self.read_register(reg)
+        self._shadow[reg] = actual
+        if actual == self._wanted[reg]:
+            return True
+
+        self.verify()
+        return False
+
+
+class BitDebouncer:
+    '''
+    Bit-parallel debouncer for a word of switch inputs.
+
+    Every bit has its own integrator, stored as a vertical counter: bit `b` of
+    `self._counts[j]` is bit `j` of the counter for input `b`. Each sample
+    advances all of the counters at once with a handful of integer operations,
+    no matter how wide the word is.
+
+    A counter runs while its input disagrees with the debounced output and is
+    cleared as soon as they agree again. When a counter reaches the settle
+    count for its bit the debounced output flips.
+    '''
+
+    def __init__(self, settle_samples: list[int], initial: int = 0) -> None:
+        '''
+        `BitDebouncer(settle, init)` debounces a word with one bit for every entry
+        in `settle`, starting from the debounced value `init`.
+
+        Args:
+            `settle_samples` (list[int]): the number of consecutive disagreeing
+                samples needed to flip each bit, bit 0 first
+            `initial` (int): the starting debounced word
+
+        Raises:
+            ValueError if any settle count is less than 1.
+        '''
+        if any(n < 1 for n in settle_samples):
+            raise ValueError('settle counts must be at least 1')
+
+        num_planes = max(settle_samples).bit_length()
+
+        # the per-bit settle counts, stored vertically like the counters
+        self._thresholds = [0] * num_planes
+        for bit, n in enumerate(settle_samples):
+            for j in range(num_planes):
+                if (n >> j) & 1:
+                    self._thresholds[j] |= 1 << bit
+
+        self._counts = [0] * num_planes
+        self._mask = (1 << len(settle_samples)) - 1
+
+        self.stable = initial & self._mask
+        self.pending = 0
+
+    def update(self, raw: int, advance: bool = True) -> int:
+        '''
+        `update(raw, adv)` feeds one sample `raw` to every integrator and is the
+        new debounced word.
+
+        Args:
+            `raw` (int): the latest raw reading
+            `advance` (bool): if false the sample only clears integrators whose
+                input agrees with the output, it does not count towards settling.
+                This keeps samples that arrive in a burst from settling early.
+        '''
+        delta = (raw ^ self.stable) & self._mask
+
+        if not advance:
+            for j in range(len(self._counts)):
+                self._counts[j] &= delta
+            self.pending = delta
+            return self.stable
+
+        # increment the counters of the disagreeing bits, clear the rest
+        carry = delta
+        for j in range(len(self._counts)):
+            count_j = self._counts[j] & delta
+            self._counts[j] = count_j ^ carry
+            carry &= count_j
+
+        # find the counters that now equal their settle count
+        settled = delta
+        for j in range(len(self._counts)):
+            settled &= ~(self._counts[j] ^ self._thresholds[j])
+
+        if settled:
+            self.stable ^= settled
+            for j in range(len(self._counts)):
+                self._counts[j] &= ~settled
+
+        self.pending = delta & ~settled
+        return self.stable
+
+
+class WiringMap:
+    '''
+    Bit permutation from physical input bits to logical switch bits, compiled
+    into one 256 entry lookup table for each byte of the input word.
+
+    Each table entry is the logical word contributed by one value of its byte,
+    so a word of `n` bytes is remapped with `n` lookups and ORs no matter how
+    the bits are scattered.
+    '''
+
+    def __init__(self, width: int, mapping: dict[int, int]) -> None:
+        '''
+        `WiringMap(w, m)` permutes a `w` bit word so that logical bit `i` is
+        physical bit `m[i]`. Logical bits that are not in `m` keep their position.
+
+        Raises:
+            ValueError if a bit is out of range or two logical bits share a physical bit.
+        '''
+        if any(not 0 <= bit < width for pair in mapping.items() for bit in pair):
+            raise ValueError(f'wiring bits must be in the range [0, {width})')
+
+        source = [mapping.get(logical, logical) for logical in range(width)]
+        if len(set(source)) != width:
+            raise ValueError('every logical bit must be wired to its own physical bit')
+
+        self.width = width
+        self.is_identity = all(physical == logical for logical, physical in enumerate(source))
+
+        destination = [0] * width
+        for logical, physical in enumerate(source):
+            destination[physical] = logical
+
+        self._tables = []
+        for byte in range((width + 7) // 8):
+            table = [0] * 256
+            for value in range(1, 256):
+                # an entry is the entry without its lowest set bit, plus that bit
+                low = (value & -value).bit_length() - 1
+                physical = byte * 8 + low
+                bit = 1 << destination[physical] if physical < width else 0
+                table[value] = table[value & (value - 1)] | bit
+            self._tables.append(table)
+
+    def remap(self, word: int) -> int:
+        '''
+        `remap(w)` is the physical word `w` in logical bit order.
+        '''
+        logical = 0
+        for table in self._tables:
+            logical |= table[word & 0xFF]
+            word >>= 8
+        return logical
+
+
+class SampleRecorder:
+    '''
+    Fixed size ring buffer of raw switch samples.
+
+    Every sample is packed into a preallocated bytearray, so recording costs no
+    allocation and a session of any length runs in bounded memory. Once the
+    buffer is full the oldest samples are overwritten.
+
+    `dump(path)` writes a 16 byte header followed by the samples, oldest first,
+    as fixed size little endian records:
+
+        t_ns   : uint64, time.monotonic_ns() when the read completed
+        edge_t_ns : uint64, kernel timestamp of the interrupt edge that triggered
+                 the read on the same clock, or 0 if it is not known
+        top    : uint64, raw top row
+        btm    : uint64, raw bottom row
+        status : uint8, UI_Switches.StatusCode value of the read
+        (7 pad bytes)
+
+    The records start at `HEADER.size` and can be memory-mapped, for example with
+    `numpy.memmap(path, dtype=SampleRecorder.NUMPY_DTYPE, offset=16)`.
+    '''
+    MAGIC = b'OBSW'
+    VERSION = 3
+    HEADER = struct.Struct('<4sHHQ')  # magic, version, record size, record count
+    RECORD = struct.Struct('<QQQQB7x')
+    NUMPY_DTYPE = [
+        ('t_ns', '<u8'), ('edge_t_ns', '<u8'), ('top', '<u8'), ('btm', '<u8'),
+        ('status', 'u1'), ('pad', 'V7')
+    ]
+
+    def __init__(self, capacity: int) -> None:
+        '''
+        `SampleRecorder(n)` is an empty recorder holding at most `n` samples.
+
+        Raises:
+            ValueError if `capacity` is less than 1.
+        '''
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        self._capacity = capacity
+        self._buf = bytearray(capacity * self.RECORD.size)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._count = 0
+        self.num_overwritten = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def record(self, t_ns: int, edge_t_ns: int, top_row: int, btm_row: int, status: int) -> None:
+        '''
+        `record(t, edge_t, top, btm, status)` appends one sample, overwriting the
+        oldest sample if the buffer is full.
+        '''
+        with self._lock:
+            self.RECORD.pack_into(
+                self._buf, self._next * self.RECORD.size, t_ns, edge_t_ns, top_row, btm_row, status)
+            self._next += 1
+            if self._next == self._capacity:
+                self._next = 0
+            if self._count < self._capacity:
+                self._count += 1
+            else:
+                self.num_overwritten += 1
+
+    def clear(self) -> None:
+        '''
+        `clear()` forgets every recorded sample, the buffer itself is kept.
+        '''
+        with self._lock:
+            self._next = 0
+            self._count = 0
+            self.num_overwritten = 0
+
+    def dump(self, path: str) -> int:
+        '''
+        `dump(path)` writes the recorded samples to the file at `path`, oldest
+        first, and is the number of samples written.
+
+        Only the samples in use are copied while the recorder is locked, oldest
+        first, and they are written to disk afterwards, so recording is never
+        blocked on file I/O.
+        '''
+        with self._lock:
+            count = self._count
+            start = (self._next - count) % self._capacity * self.RECORD.size
+            end = start + count * self.RECORD.size
+            if end <= len(self._buf):
+                snapshot = self._buf[start:end]
+            else:
+                # the samples wrap around the end of the ring
+                snapshot = self._buf[start:] + self._buf[:end - len(self._buf)]
+
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size, count))
+            f.write(snapshot)
+
+        return count
+
+    @classmethod
+    def load(cls, path: str) -> list[tuple[int, int, int, int, int]]:
+        '''
+        `load(path)` is the list of (t_ns, edge_t_ns, top, btm, status) samples in
+        a file written by `dump()`.
+
+        Raises:
+            ValueError if the file is not a sample dump of this version.
+        '''
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, record_size, count = cls.HEADER.unpack_from(mm)
+                if magic != cls.MAGIC or version != cls.VERSION or record_size != cls.RECORD.size:
+                    raise ValueError(f'{path} is not a version {cls.VERSION} sample dump')
+                end = cls.HEADER.size + count * record_size
+                return list(cls.RECORD.iter_unpack(mm[cls.HEADER.size:end]))
+
+
+class GpiodInterruptLine:
+    '''
+    Interrupt input read through the kernel GPIO character device with libgpiod.
+
+    The kernel stamps every falling edge when the hardware interrupt fires, on
+    the same clock as `time.monotonic_ns()`, so the timestamp is free of the
+    Python scheduling jitter that comes before the callback runs. A thread
+    blocks in `select()` on the line request, so no CPU is used while waiting.
+
+    Offers the parts of the gpiozero.Button interface that UI_Switches uses:
+    `when_pressed`, `is_pressed` and `close()`. The callback is called with the
+    kernel edge timestamp in nanoseconds.
+    '''
+
+    def __init__(self, pin: int, chip_path: str = '/dev/gpiochip0') -> None:
+        '''
+        `GpiodInterruptLine(pin, chip)` requests line `pin` on the GPIO chip device
+        at `chip` as a pulled up input with falling edge detection.
+
+        Raises:
+            RuntimeError if the libgpiod v2 bindings are not installed.
+            OSError if the line can not be requested.
+        '''
+        if gpiod is None:
+            raise RuntimeError('GpiodInterruptLine requires the libgpiod v2 python bindings')
+
+        self._pin = pin
+        self._request = gpiod.request_lines(
+            chip_path,
+            consumer='UI_Switches',
+            config={
+                pin: gpiod.LineSettings(edge_detection=Edge.FALLING, bias=Bias.PULL_UP)
+            }
+        )
+
+        self.when_pressed = None
+
+        # writing to this pipe wakes the event thread so it can exit
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = threading.Thread(
+            target=self._run, name='UI_Switches gpiod', daemon=True)
+        self._thread.start()
+
+    @property
+    def is_pressed(self) -> bool:
+        '''
+        `is_pressed` is true iff the interrupt line is currently low.
+        '''
+        return self._request.get_value(self._pin) == Value.INACTIVE
+
+    def _run(self) -> None:
+        while True:
+            readable, _, _ = select.select([self._request.fd, self._stop_r], [], [])
+            if self._stop_r in readable:
+                return
+            for edge in self._request.read_edge_events():
+                callback = self.when_pressed
+                if callback is not None:
+                    callback(edge.timestamp_ns)
+
+    def close(self) -> None:
+        '''
+        `close()` stops the event thread and releases the line.
+        '''
+        os.write(self._stop_w, b'x')
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        os.close(self._stop_r)
+        os.close(self._stop_w)
+        self._request.release()
 
 
 class UI_Switches:
@@ -37,18 +839,38 @@ class UI_Switches:
 
     Requires:
       - Shared use of I2C bus, with four addresses in the range [0x20, 0x27].
+        When other devices share the bus pass an I2CBusManager client with HIGH
+        priority in place of the SMBus object, so switch reads go first.
       - A GPIO pin to use as the interrupt pin, which goes LOW whenever any of the
         32 switches change state, and goes high again after an I2C reading occurs.
 
+    Larger panels of up to four daisy-chained boards, using all eight addresses,
+    can be built with `UI_Switches.from_boards()`. Each board adds 16 bits to
+    both rows, and where the voltage and aux switches sit is declared in data.
+    Box revisions that wire switches to other bits pass a `wiring` map, and the
+    raw rows are put into logical order with table lookups right after each read.
+
     Note:
       It is possible for the interrupt line to become stuck down if the switches
       have lots of mechanical chatter. A manual read will clear the interrupt
       and un-stick the line.
+
+      A watchdog thread checks the interrupt line level (a GPIO read, no I2C
+      traffic) and only polls the switches while the line is held low without a
+      fresh read, backing off to interrupt-only operation once it is released.
+
+      Chatter can also be filtered in software by giving a debounce settle time,
+      in which case the readings pass through a BitDebouncer before they are
+      cached, and follow-up reads are scheduled until every switch has settled.
     '''
+    # the standard two board panel, instances built with `from_boards()` override these
     NUM_SWITCHES = 32  # total number of switches
     NUM_V_SWITCHES = 30  # just the voltage switches minus the two aux switches
     V_SWITCH_MASK = 0x3FFF_FFFF  # binary mask to extract just the voltage switches
 
+    SWITCHES_PER_BOARD = 16  # each board has one PCA9555D for each row
+    MAX_BOARDS = 4  # the eight addresses in [0x20, 0x27] are shared by two chips per board
+
     class Row(Enum):
         '''
         The physical switches are DPDT Center Off. The UP and MIDDLE positions are
@@ -76,6 +898,14 @@ class UI_Switches:
         THREE = 2
         FOUR = 3
 
+    # where each aux switch is wired on the standard panel, as (row, bit)
+    AUX_SWITCH_MAP = {
+        AuxSwitch.ONE: (Row.TOP, 30),
+        AuxSwitch.TWO: (Row.BOTTOM, 30),
+        AuxSwitch.THREE: (Row.TOP, 31),
+        AuxSwitch.FOUR: (Row.BOTTOM, 31),
+    }
+
     class StatusCode(Enum):
         '''
         Enumerated status for identifying I2C errors.
@@ -83,6 +913,155 @@ class UI_Switches:
         OK = 0
         I2C_ERROR = 1
 
+    class InterruptBackend(Enum):
+        '''
+        Enumerated ways of watching the interrupt pin.
+
+        GPIOZERO : a gpiozero.Button, edges are not timestamped
+        GPIOD    : a GpiodInterruptLine, every poll carries the kernel edge timestamp
+        '''
+        GPIOZERO = 0
+        GPIOD = 1
+
+    class ReadMode(Enum):
+        '''
+        Enumerated strategies for reading the input ports of the PCA9555D chips.
+
+        BYTE  : two SMBus transactions per chip, one for each input port
+        BLOCK : one combined register-write and two byte read per chip
+        BATCH : every chip is queued into a single i2c_rdwr call, requires smbus2
+        '''
+        BYTE = 0
+        BLOCK = 1
+        BATCH = 2
+
+    # PCA9555D register holding the first input port, the second port follows it
+    INPUT_PORT_0 = PCA9555.INPUT_PORT_0
+
+    # the number of unread events kept for `get_events()`, older events are dropped
+    MAX_PENDING_EVENTS = 64
+
+    class SwitchEvent:
+        '''
+        A compact description of what moved between two consecutive readings.
+
+        Attributes:
+            v_switch_mask    : bit i is set iff voltage switch i changed position
+            v_switch_changes : tuple of (i, old SwitchPos, new SwitchPos) for each
+                               voltage switch that changed, lowest switch first
+            aux_changes      : tuple of (AuxSwitch, engaged) for each aux switch
+                               that changed, `engaged` is the new state
+            top_row          : the new top row as an integer
+            btm_row          : the new bottom row as an integer
+            snapshot         : the SwitchSnapshot the switches moved to
+            read_t_ns        : time.monotonic_ns() when the I2C read completed
+            edge_t_ns        : kernel timestamp of the interrupt edge that triggered
+                               the read, on the same clock as `read_t_ns`, or None if
+                               the read was not triggered by a timestamped edge
+        '''
+        __slots__ = (
+            'v_switch_mask', 'v_switch_changes', 'aux_changes', 'top_row', 'btm_row',
+            'snapshot', 'read_t_ns', 'edge_t_ns'
+        )
+
+        def __init__(
+            self,
+            v_switch_mask: int,
+            v_switch_changes: tuple,
+            aux_changes: tuple,
+            snapshot: 'UI_Switches.SwitchSnapshot',
+            read_t_ns: int,
+            edge_t_ns: Optional[int]
+        ) -> None:
+            self.v_switch_mask = v_switch_mask
+            self.v_switch_changes = v_switch_changes
+            self.aux_changes = aux_changes
+            self.top_row = snapshot.top_row
+            self.btm_row = snapshot.btm_row
+            self.snapshot = snapshot
+            self.read_t_ns = read_t_ns
+            self.edge_t_ns = edge_t_ns
+
+        def __repr__(self) -> str:
+            return (
+                f"SwitchEvent(v_switch_mask={self.v_switch_mask:#010x}, "
+                f"v_switch_changes={self.v_switch_changes}, aux_changes={self.aux_changes})"
+            )
+
+    class SwitchSnapshot:
+        '''
+        An immutable, fully decoded reading of all of the switches, made once per
+        poll so that every accessor is a constant time lookup.
+
+        Snapshots are published by swapping a single reference, so a reader that
+        takes one snapshot always sees a top and bottom row from the same poll.
+
+        Attributes:
+            seq            : sequence number, incremented each time the switches change
+            top_row        : the raw top row as an integer
+            btm_row        : the raw bottom row as an integer
+            up_mask        : bit i is set iff voltage switch i is UP
+            middle_mask    : bit i is set iff voltage switch i is in the MIDDLE
+            down_mask      : bit i is set iff voltage switch i is DOWN
+            shock_level    : see `UI_Switches.get_shock_level()`
+            aux_mask       : bit n is set iff the n-th entry of the aux switch map is closed
+            num_v_switches : the number of voltage switches on the panel
+            read_t_ns      : time.monotonic_ns() when the read that first saw this
+                             state completed, 0 before the first read
+            edge_t_ns      : kernel timestamp of the interrupt edge that triggered that
+                             read, or None if it was not triggered by a timestamped edge
+        '''
+        __slots__ = (
+            'seq', 'top_row', 'btm_row', 'up_mask', 'middle_mask', 'down_mask',
+            'shock_level', 'aux_mask', 'num_v_switches', 'read_t_ns', 'edge_t_ns', '_positions'
+        )
+
+        def __init__(
+            self,
+            seq: int,
+            top_row: int,
+            btm_row: int,
+            up_mask: int,
+            middle_mask: int,
+            down_mask: int,
+            aux_mask: int,
+            num_v_switches: int,
+            read_t_ns: int = 0,
+            edge_t_ns: Optional[int] = None
+        ) -> None:
+            self.seq = seq
+            self.top_row = top_row
+            self.btm_row = btm_row
+            self.up_mask = up_mask
+            self.middle_mask = middle_mask
+            self.down_mask = down_mask
+            self.shock_level = down_mask.bit_length()
+            self.aux_mask = aux_mask
+            self.num_v_switches = num_v_switches
+            self.read_t_ns = read_t_ns
+            self.edge_t_ns = edge_t_ns
+            self._positions = None
+
+        def position_at(self, i: int) -> 'UI_Switches.SwitchPos':
+            '''
+            `position_at(i)` is the enumerated position of voltage switch `i`.
+            '''
+            if (self.down_mask >> i) & 1:
+                return UI_Switches.SwitchPos.DOWN
+            if (self.up_mask >> i) & 1:
+                return UI_Switches.SwitchPos.UP
+            return UI_Switches.SwitchPos.MIDDLE
+
+        @property
+        def positions(self) -> tuple:
+            '''
+            `positions` is the tuple of enumerated positions of every voltage switch,
+            built the first time it is asked for.
+            '''
+            if self._positions is None:
+                self._positions = tuple(self.position_at(i) for i in range(self.num_v_switches))
+            return self._positions
+
     def __init__(
         self,
         bus: smbus.SMBus,
@@ -91,7 +1070,28 @@ class UI_Switches:
         addr_0_15_btm: int,
         addr_16_31_btm: int,
         interrupt_pin: int,
-        callback: Callable = (lambda: None)
+        callback: Callable = (lambda: None),
+        read_mode: ReadMode = ReadMode.BLOCK,
+        event_callback: Callable = (lambda event: None),
+        debounce_settle_secs: float = 0.0,
+        debounce_settle_overrides: Optional[dict[int, float]] = None,
+        debounce_period_secs: float = 0.002,
+        watchdog_check_secs: float = 0.5,
+        watchdog_stuck_secs: float = 0.05,
+        watchdog_fast_poll_secs: float = 0.005,
+        recorder: Optional[SampleRecorder] = None,
+        interrupt_backend: InterruptBackend = InterruptBackend.GPIOZERO,
+        gpio_chip: str = '/dev/gpiochip0',
+        bank_retries: int = 2,
+        bank_retry_backoff_secs: float = 0.0005,
+        boards: Optional[list[tuple[int, int]]] = None,
+        num_v_switches: Optional[int] = None,
+        aux_switch_map: Optional[dict] = None,
+        threaded_callbacks: bool = False,
+        snapshot_callback: Callable = (lambda snapshot: None),
+        hw_polarity_inversion: bool = False,
+        verify_period_secs: float = 5.0,
+        wiring: Optional[dict] = None
     ) -> None:
         '''
         Initialize the UI Switches with the given I2C bus object and addresses
@@ -105,60 +1105,758 @@ class UI_Switches:
             addr_16_31_btm : the I2C address of PCA9555D[3]
             interrupt_pin  : the pin number of the interrupt pin
             callback       : the callback function to run when the interrupt pin fires
+            read_mode      : the enumerated strategy used to read the input ports
+            event_callback : called with a SwitchEvent whenever a poll sees a change
+            debounce_settle_secs      : how long a switch must hold a new state before
+                                        it is reported, 0.0 disables debouncing
+            debounce_settle_overrides : per-switch settle times keyed by switch number,
+                                        these replace `debounce_settle_secs` for those switches
+            debounce_period_secs      : the debounce sample period, follow-up reads are
+                                        this far apart while any switch is settling
+            watchdog_check_secs       : how often the watchdog checks the interrupt line
+                                        while it is healthy, 0.0 disables the watchdog
+            watchdog_stuck_secs       : how long the line may stay low without a read
+                                        before it is considered stuck
+            watchdog_fast_poll_secs   : the first retry interval for a stuck line, it
+                                        doubles on each retry up to `watchdog_check_secs`
+            recorder                  : optional SampleRecorder that gets every raw reading,
+                                        in physical bit order
+            interrupt_backend         : the enumerated way of watching the interrupt pin
+            gpio_chip                 : the GPIO character device used by the GPIOD backend
+            bank_retries              : how many times a failed bank is retried in one poll
+            bank_retry_backoff_secs   : the wait before the first retry, doubling each time
+            boards                    : see `from_boards()`, replaces the four addresses
+            num_v_switches            : see `from_boards()`
+            aux_switch_map            : see `from_boards()`
+            threaded_callbacks        : if true `callback` and `snapshot_callback` run on a
+                                        dispatcher thread and only see the newest state,
+                                        instead of running on the polling thread. Events
+                                        go to `event_callback` and the asyncio consumers
+                                        from the same thread, all of them and in order.
+            snapshot_callback         : called with the SwitchSnapshot after every read
+            hw_polarity_inversion     : if true the chips invert their inputs, so a closed
+                                        switch reads as 1 and no inversion is done in Python.
+                                        This flips the bits of the raw rows, see ACTIVE_LEVEL.
+            verify_period_secs        : how often the chip configuration is checked for a
+                                        brown-out reset, the check rides on the next read
+            wiring                    : maps a logical (Row, switch) to the physical (Row, bit)
+                                        it is wired to, for boxes that are not wired switch i
+                                        to bit i. Unlisted switches keep their own bit.
 
         Note:
             All I2C addresses for the PCA9555D chips must be in the range [0x20, 0x27], this
             is set with solder jumpers on the physical PCBs.
+
+        Raises:
+            ValueError if `read_mode` is BATCH but the bus does not support i2c_rdwr.
+            ValueError if the board addresses or switch maps are not valid.
+            ValueError if a debounce settle time or its switch number is not valid.
         '''
+        if read_mode == self.ReadMode.BATCH and (i2c_msg is None or not hasattr(bus, 'i2c_rdwr')):
+            raise ValueError('ReadMode.BATCH requires an smbus2.SMBus bus object')
+
+        if boards is None:
+            boards = [(addr_0_15_top, addr_0_15_btm), (addr_16_31_top, addr_16_31_btm)]
+        self._configure_panel(boards, num_v_switches, aux_switch_map, wiring)
+
+        # every argument is checked before the pin and threads are claimed, so a bad
+        # call can be retried
+        if debounce_settle_secs < 0.0:
+            raise ValueError('debounce settle times must be at least 0.0')
+        for i, secs in (debounce_settle_overrides or {}).items():
+            if not 0 <= i < self.NUM_SWITCHES:
+                raise ValueError(f'there is no switch {i} to debounce')
+            if secs < 0.0:
+                raise ValueError('debounce settle times must be at least 0.0')
+
         self._bus = bus
 
-        # since the switches have built in pullups, we short them to ground to engage a switch
-        self.ACTIVE_LEVEL = 0
+        self._read_mode = read_mode
 
-        self.STATUS = self.StatusCode.OK
+        # the number of calls made on the bus object, each one is a round trip to the kernel
+        self._num_transactions = 0
+
+        # since the switches have built in pullups, we short them to ground to engage a switch,
+        # unless the chips are set to invert their inputs
+        self.ACTIVE_LEVEL = 1 if hw_polarity_inversion else 0
 
-        self._top_row_addrs = [addr_0_15_top, addr_16_31_top]
-        self._btm_row_addrs = [addr_0_15_btm, addr_16_31_btm]
+        # all pins are inputs, polarity inversion is set up on the first read of each chip
+        polarity = 0xFFFF if hw_polarity_inversion else 0x0000
+        self._chips = {
+            addr: PCA9555(bus, addr, polarity=polarity)
+            for addr in self._top_row_addrs + self._btm_row_addrs
+        }
+        self._verify_period_secs = verify_period_secs
+        self._last_verify_t = time.monotonic()
 
-        self._interrupt_pin = gpiozero.Button(interrupt_pin)
+        self.STATUS = self.StatusCode.OK
+
+        if interrupt_backend == self.InterruptBackend.GPIOD:
+            self._interrupt_pin = GpiodInterruptLine(interrupt_pin, gpio_chip)
+        else:
+            self._interrupt_pin = gpiozero.Button(interrupt_pin)
 
         self._callback = callback
+        self._event_callback = event_callback
+        self._recorder = recorder
+        self._snapshot_callback = snapshot_callback
+
+        # a slow consumer must never hold up the next read
+        self._dispatcher = None
+        # events can't be coalesced, so they wait here for the dispatcher in order
+        self._dispatch_events = deque()
+        self._dispatch_events_lock = threading.Lock()
+        self._num_dispatch_events_dropped = 0
+        if threaded_callbacks:
+            self._dispatcher = CoalescingDispatcher(
+                self._run_callbacks, name='UI_Switches dispatcher')
 
         self._addrs_with_errors = set()
 
-        self._cached_top_row = 0
-        self._cached_btm_row = 0
+        self._bank_retries = bank_retries
+        self._bank_retry_backoff_secs = bank_retry_backoff_secs
+
+        # last known good word of each bank, all switches open until the first read
+        self._bank_words = {}
+        self._bank_good_t = {}
+        self._bank_stats = {}
+        for addr in self._top_row_addrs + self._btm_row_addrs:
+            self._bank_words[addr] = 0xFFFF if self.ACTIVE_LEVEL == 0 else 0x0000
+            self._bank_good_t[addr] = None
+            self._bank_stats[addr] = {'errors': 0, 'retries': 0}
+
+        self._publish_lock = threading.Lock()
+        # like the banks, the first snapshot has every switch open
+        self._snapshot = self._make_snapshot(*self._bank_rows(), 0)
+
+        # there is nothing to compare the very first reading against
+        self._have_reading = False
 
         self._change_occured = False
+        self._events = deque(maxlen=self.MAX_PENDING_EVENTS)
+
+        # asyncio consumers, as (event loop, queue or future) pairs
+        self._async_lock = threading.Lock()
+        self._async_queues = []
+        self._async_waiters = []
+
+        # follow-up reads while switches settle come from one thread, started on first use
+        self._debouncer = None
+        self._debounce_lock = threading.Lock()
+        self._debounce_cv = threading.Condition(self._debounce_lock)
+        self._debounce_thread = None
+        self._debounce_due_t = None
+        self._debounce_stop = False
+        self._debounce_period_secs = debounce_period_secs
+        self._debounce_settle_samples = None
+        self._last_sample_t = 0.0
+        self._settle_start_t = None
+        self._debounce_stats = {
+            'samples': 0,
+            'glitches_rejected': 0,
+            'last_latency_secs': 0.0,
+            'max_latency_secs': 0.0,
+        }
+
+        if debounce_settle_secs > 0.0 or debounce_settle_overrides:
+            settle_secs = [debounce_settle_secs] * self.NUM_SWITCHES
+            for i, secs in (debounce_settle_overrides or {}).items():
+                settle_secs[i] = secs
+            self._debounce_settle_samples = [
+                max(1, round(secs / debounce_period_secs)) for secs in settle_secs
+            ]
+
+        self._last_poll_t = 0.0
+        self._stuck_since_t = None
+        self._watchdog_check_secs = watchdog_check_secs
+        self._watchdog_stuck_secs = watchdog_stuck_secs
+        self._watchdog_fast_poll_secs = watchdog_fast_poll_secs
+        self._watchdog_wake = threading.Event()
+        self._watchdog_stop = threading.Event()
+        self._watchdog_thread = None
+        self._watchdog_stats = {
+            'stuck_episodes': 0,
+            'watchdog_polls': 0,
+            'last_recovery_secs': 0.0,
+            'max_recovery_secs': 0.0,
+        }
+
+        # at most one read is in flight and at most one more is pending, see `poll()`
+        self._poll_cv = threading.Condition()
+        self._poll_thread = None
+        self._poll_pending = False
+        self._pending_edge_t_ns = None
+        self._reads_started = 0
+        self._reads_completed = 0
+        self._poll_triggers = 0
 
         # each time the interrupt pin activates call the function to read all of the switches
-        self._interrupt_pin.when_pressed = self.poll
+        self._interrupt_pin.when_pressed = self._on_interrupt
 
         # manually trigger the poll function to cache initial switch readings
         self.poll()
 
-    def poll(self) -> None:
+        if watchdog_check_secs > 0.0:
+            self._watchdog_thread = threading.Thread(
+                target=self._run_watchdog, name='UI_Switches watchdog', daemon=True)
+            self._watchdog_thread.start()
+
+    @classmethod
+    def from_boards(
+        cls,
+        bus: smbus.SMBus,
+        boards: list[tuple[int, int]],
+        interrupt_pin: int,
+        num_v_switches: Optional[int] = None,
+        aux_switch_map: Optional[dict] = None,
+        wiring: Optional[dict] = None,
+        **kwargs
+    ) -> 'UI_Switches':
+        '''
+        `from_boards(bus, boards, pin)` is the UI Switches for a panel of any number
+        of daisy-chained switch boards.
+
+        Args:
+            bus            : the I2C device to use
+            boards         : a (top address, bottom address) pair for each board, in
+                             chain order. Board k holds switches [16k, 16k + 15].
+            interrupt_pin  : the pin number of the interrupt pin
+            num_v_switches : the number of voltage switches, they are switches
+                             [0, num_v_switches). Defaults to NUM_V_SWITCHES.
+            aux_switch_map : maps each aux switch key to its (Row, bit), keys can be
+                             any hashable. Defaults to AUX_SWITCH_MAP.
+            wiring         : maps a logical (Row, switch) to its physical (Row, bit),
+                             switches and aux bits above are in logical order
+            **kwargs       : any of the other keyword arguments of `UI_Switches()`
+
+        Raises:
+            ValueError if the addresses or switch maps are not valid.
         '''
-        `poll()` reads all of the switches and caches their values as 32 bit 
-        numbers, this included the voltage switches and also the two aux switches.
+        return cls(
+            bus, None, None, None, None, interrupt_pin,
+            boards=boards, num_v_switches=num_v_switches, aux_switch_map=aux_switch_map,
+            wiring=wiring, **kwargs
+        )
+
+    def _configure_panel(
+        self,
+        boards: list[tuple[int, int]],
+        num_v_switches: Optional[int],
+        aux_switch_map: Optional[dict],
+        wiring: Optional[dict]
+    ) -> None:
+        '''
+        `_configure_panel(boards, n, aux_map, wiring)` validates the panel layout and
+        sets up the row widths, masks, aux switch tables and wiring map used by every poll.
+
+        Raises:
+            ValueError if the addresses or switch maps are not valid.
+        '''
+        if not 1 <= len(boards) <= self.MAX_BOARDS:
+            raise ValueError(f'a panel has between 1 and {self.MAX_BOARDS} boards')
+
+        addrs = [addr for board in boards for addr in board]
+        if any(not 0x20 <= addr <= 0x27 for addr in addrs):
+            raise ValueError('PCA9555D addresses must be in the range [0x20, 0x27]')
+        if len(set(addrs)) != len(addrs):
+            raise ValueError('every PCA9555D must have its own address')
+
+        self._top_row_addrs = [top for top, _ in boards]
+        self._btm_row_addrs = [btm for _, btm in boards]
+
+        self.NUM_SWITCHES = self.SWITCHES_PER_BOARD * len(boards)
+
+        if num_v_switches is None:
+            num_v_switches = type(self).NUM_V_SWITCHES
+        if not 0 <= num_v_switches <= self.NUM_SWITCHES:
+            raise ValueError(f'there are only {self.NUM_SWITCHES} switches on {len(boards)} boards')
+        self.NUM_V_SWITCHES = num_v_switches
+        self.V_SWITCH_MASK = (1 << num_v_switches) - 1
+
+        if aux_switch_map is None:
+            aux_switch_map = self.AUX_SWITCH_MAP
+
+        # aux switch n in map order is bit n of a snapshot's aux_mask
+        self._aux_keys = list(aux_switch_map)
+        self._aux_index = {key: n for n, key in enumerate(self._aux_keys)}
+        self._aux_wiring = []
+        for key in self._aux_keys:
+            row, bit = aux_switch_map[key]
+            if not num_v_switches <= bit < self.NUM_SWITCHES:
+                raise ValueError(f'aux switch {key} is not wired to a free switch bit')
+            self._aux_wiring.append((row == self.Row.TOP, bit))
+
+        # both rows are remapped together, so a switch may be wired to the other row
+        self._wiring = None
+        if wiring:
+            def combined_bit(row, bit):
+                if not 0 <= bit < self.NUM_SWITCHES:
+                    raise ValueError(f'wiring bits must be in the range [0, {self.NUM_SWITCHES})')
+                return bit + self.NUM_SWITCHES if row == self.Row.TOP else bit
+
+            wiring_map = WiringMap(2 * self.NUM_SWITCHES, {
+                combined_bit(*logical): combined_bit(*physical)
+                for logical, physical in wiring.items()
+            })
+            if not wiring_map.is_identity:
+                self._wiring = wiring_map
+
+    def poll(self, edge_t_ns: Optional[int] = None, wait: bool = True) -> None:
+        '''
+        `poll()` reads all of the switches and caches their values as one integer
+        per row, this included the voltage switches and also the aux switches.
+
+        `poll(t)` does the same for a read triggered by an interrupt edge with
+        kernel timestamp `t`, which is passed on to the event and the recorder.
+
+        The new readings are compared against the cached ones, and if anything
+        moved a SwitchEvent is queued and handed to the event callback. A poll
+        that reads identical rows produces no event.
 
         After the switches are read the callback function is executed.
 
         This function is intended to be called automatically when the interrupt pin
-        fires, but it can also be manually triggered.
-        '''
-        try:
-            self._change_occured = True
+        fires, but it can also be manually triggered, from any thread.
 
-            self._cached_top_row = self._read_row(self.Row.TOP)
-            self._cached_btm_row = self._read_row(self.Row.BOTTOM)
+        Only one read is ever in flight. A poll that arrives during a read marks
+        one follow-up read as pending, which the reading thread runs as soon as
+        it finishes, so any number of overlapping polls collapse into at most two
+        reads. With `wait` true the call returns once a read that started after
+        the call has completed, otherwise it returns immediately.
+        '''
+        with self._poll_cv:
+            self._poll_triggers += 1
+
+            if self._poll_thread is not None:
+                self._poll_pending = True
+                if self._pending_edge_t_ns is None:
+                    # keep the earliest edge, reaction times are measured from it
+                    self._pending_edge_t_ns = edge_t_ns
+
+                # the reading thread itself (e.g. from a callback) must not wait on itself
+                if wait and self._poll_thread is not threading.current_thread():
+                    target = self._reads_started + 1
+                    while self._reads_completed < target:
+                        self._poll_cv.wait()
+                return
+
+            self._poll_thread = threading.current_thread()
+            self._reads_started += 1
+
+        while True:
+            self._read_and_publish(edge_t_ns)
+
+            with self._poll_cv:
+                self._reads_completed += 1
+                self._poll_cv.notify_all()
+
+                if not self._poll_pending:
+                    self._poll_thread = None
+                    return
+
+                self._poll_pending = False
+                edge_t_ns = self._pending_edge_t_ns
+                self._pending_edge_t_ns = None
+                self._reads_started += 1
+
+    def _on_interrupt(self, edge_t_ns: Optional[int] = None) -> None:
+        '''
+        `_on_interrupt(t)` is the interrupt pin handler. It never waits for a read
+        on another thread, the interrupt thread only needs the read scheduled.
+        '''
+        self.poll(edge_t_ns, wait=False)
 
-            self.STATUS = self.StatusCode.OK
+    def get_poll_stats(self) -> dict:
+        '''
+        `get_poll_stats()` is a copy of the poll scheduling counters:
 
-            self._callback()
+            triggers  : calls to `poll()`, from interrupts, timers and callers
+            reads     : reads that were actually made
+            coalesced : triggers that were served by another trigger's read
+        '''
+        with self._poll_cv:
+            return {
+                'triggers': self._poll_triggers,
+                'reads': self._reads_started,
+                'coalesced': self._poll_triggers - self._reads_started,
+            }
+
+    def _read_and_publish(self, edge_t_ns: Optional[int]) -> None:
+        '''
+        `_read_and_publish(t)` makes one read of the switches, publishes the result
+        and runs the callbacks. Only ever called by `poll()`, one read at a time.
+        '''
+        try:
+            try:
+                top_row, btm_row, failed_addrs = self._read_rows()
+            except Exception:
+                if self._recorder is not None:
+                    self._recorder.record(
+                        time.monotonic_ns(), edge_t_ns or 0, 0, 0, self.StatusCode.I2C_ERROR.value)
+                raise
+
+            read_t_ns = time.monotonic_ns()
+
+            # a partial read is still published, the failed banks keep their last good bits
+            status = self.StatusCode.I2C_ERROR if failed_addrs else self.StatusCode.OK
+
+            if self._recorder is not None:
+                self._recorder.record(read_t_ns, edge_t_ns or 0, top_row, btm_row, status.value)
+
+            if self._wiring is not None:
+                combined = self._wiring.remap(top_row << self.NUM_SWITCHES | btm_row)
+                top_row = combined >> self.NUM_SWITCHES
+                btm_row = combined & ((1 << self.NUM_SWITCHES) - 1)
+
+            if self._debounce_settle_samples is not None:
+                top_row, btm_row = self._debounce(top_row, btm_row)
+
+            # writers are serialized so that each snapshot is diffed against the one
+            # it replaces, readers never take this lock
+            with self._publish_lock:
+                old_snapshot = self._snapshot
+                snapshot = old_snapshot
+                if top_row != old_snapshot.top_row or btm_row != old_snapshot.btm_row:
+                    snapshot = self._make_snapshot(
+                        top_row, btm_row, old_snapshot.seq + 1, read_t_ns, edge_t_ns)
+
+                event = None
+                if self._have_reading:
+                    event = self._diff_snapshots(old_snapshot, snapshot, read_t_ns, edge_t_ns)
+                else:
+                    # the first reading always counts as a change so consumers draw once
+                    self._change_occured = True
+                    self._have_reading = True
+
+                # a single reference swap publishes both rows at once
+                self._snapshot = snapshot
+                self._last_poll_t = time.monotonic()
+
+                if event is not None:
+                    self._events.append(event)
+                    self._change_occured = True
+
+            self.STATUS = status
+
+            # a line that is still low right after a read is stuck, don't wait for
+            # the watchdog's next check
+            if (self._watchdog_thread is not None and self._stuck_since_t is None
+                    and self._interrupt_pin.is_pressed):
+                self._watchdog_wake.set()
+
+            if self._dispatcher is not None:
+                if event is not None:
+                    with self._dispatch_events_lock:
+                        if len(self._dispatch_events) == self.MAX_PENDING_EVENTS:
+                            self._dispatch_events.popleft()
+                            self._num_dispatch_events_dropped += 1
+                        self._dispatch_events.append(event)
+                self._dispatcher.offer(snapshot)
+            else:
+                if event is not None:
+                    self._publish_event(event)
+                self._run_callbacks(snapshot)
         except Exception:
             self.STATUS = self.StatusCode.I2C_ERROR
 
+    def _run_callbacks(self, snapshot: SwitchSnapshot) -> None:
+        '''
+        `_run_callbacks(snap)` runs the user callbacks for a read that produced the
+        snapshot `snap`. On the dispatcher thread the events queued since the last
+        call are published first.
+        '''
+        while True:
+            with self._dispatch_events_lock:
+                if not self._dispatch_events:
+                    break
+                event = self._dispatch_events.popleft()
+            self._publish_event(event)
+
+        self._snapshot_callback(snapshot)
+        self._callback()
+
+    def _publish_event(self, event: SwitchEvent) -> None:
+        '''
+        `_publish_event(e)` hands the event `e` to the asyncio consumers and the
+        event callback.
+        '''
+        self._publish_async(event)
+        self._event_callback(event)
+
+    def _run_watchdog(self) -> None:
+        '''
+        `_run_watchdog()` is the body of the watchdog thread.
+
+        While the interrupt line is high the thread only wakes every
+        `watchdog_check_secs` to look at the pin level. If the line is low and no
+        read has happened for `watchdog_stuck_secs` a stuck episode starts, and the
+        switches are polled at `watchdog_fast_poll_secs`, doubling on every retry,
+        until the line is released.
+        '''
+        interval = self._watchdog_check_secs
+        retry_interval = self._watchdog_fast_poll_secs
+
+        while True:
+            self._watchdog_wake.wait(interval)
+            self._watchdog_wake.clear()
+            if self._watchdog_stop.is_set():
+                return
+
+            now = time.monotonic()
+
+            if not self._interrupt_pin.is_pressed:
+                if self._stuck_since_t is not None:
+                    recovery = now - self._stuck_since_t
+                    self._watchdog_stats['last_recovery_secs'] = recovery
+                    self._watchdog_stats['max_recovery_secs'] = max(
+                        recovery, self._watchdog_stats['max_recovery_secs'])
+                    self._stuck_since_t = None
+                interval = self._watchdog_check_secs
+                continue
+
+            since_poll = now - self._last_poll_t
+            if since_poll < self._watchdog_stuck_secs and self._stuck_since_t is None:
+                # a read is in progress or just finished, give it a chance to clear the line
+                interval = self._watchdog_stuck_secs - since_poll
+                continue
+
+            if self._stuck_since_t is None:
+                self._stuck_since_t = now
+                self._watchdog_stats['stuck_episodes'] += 1
+                retry_interval = self._watchdog_fast_poll_secs
+            else:
+                retry_interval = min(retry_interval * 2, self._watchdog_check_secs)
+            interval = retry_interval
+
+            self._watchdog_stats['watchdog_polls'] += 1
+            self.poll(wait=False)
+
+    def _read_rows(self) -> tuple[int, int, list[int]]:
+        '''
+        `_read_rows()` is the (top, bottom, failed) rows read from the chips with
+        the configured read mode, where `failed` is the list of addresses that could
+        not be read even after retrying.
+
+        Each row is an integer with 16 bits per board where switch 0 is the LSB, for
+        the standard panel switch 31 is the MSB. This includes the voltage switches
+        as well as the aux switches. The
+        bits of a failed bank are its last known good reading, so one bad chip does
+        not throw away the readings from the healthy ones.
+
+        Examples:
+            - no switches are on -> 0x0000_0000
+            - switch 0 is on -> 0x0000_0001
+            - switches 2, 5, 19, and 30 are on -> 0x4008_0024
+
+        Raises:
+            OSError if none of the I2C banks could be read.
+        '''
+        addrs = self._top_row_addrs + self._btm_row_addrs
+
+        now = time.monotonic()
+        if now - self._last_verify_t >= self._verify_period_secs:
+            self._last_verify_t = now
+            for chip in self._chips.values():
+                chip.needs_verify = True
+
+        words = None
+        # chips that need verifying are read one at a time, which verifies them first
+        if (self._read_mode == self.ReadMode.BATCH
+                and not any(chip.needs_verify for chip in self._chips.values())):
+            try:
+                words = self._read_banks_batched(addrs)
+                if any(self._inversion_lost(addr, word) for addr, word in zip(addrs, words)):
+                    # a repaired chip was read without its inversion, so read each chip again
+                    words = None
+                else:
+                    now = time.monotonic()
+                    for addr, word in zip(addrs, words):
+                        self._bank_words[addr] = word
+                        self._bank_good_t[addr] = now
+            except OSError:
+                # the batch can't say which chip failed, so fall back to one read each
+                pass
+
+        if words is None:
+            words = [self._read_bank_with_retry(addr) for addr in addrs]
+
+        failed = [addr for addr, word in zip(addrs, words) if word is None]
+        if len(failed) == len(addrs):
+            raise OSError
+
+        top_row, btm_row = self._bank_rows()
+        return top_row, btm_row, failed
+
+    def _bank_rows(self) -> tuple[int, int]:
+        '''
+        `_bank_rows()` is the (top, bottom) rows made of the last known good word of
+        every bank.
+        '''
+        top_row = 0
+        for shift, addr in enumerate(self._top_row_addrs):
+            top_row |= self._bank_words[addr] << (shift * self.SWITCHES_PER_BOARD)
+        btm_row = 0
+        for shift, addr in enumerate(self._btm_row_addrs):
+            btm_row |= self._bank_words[addr] << (shift * self.SWITCHES_PER_BOARD)
+        return top_row, btm_row
+
+    def _debounce(self, top_row: int, btm_row: int) -> tuple[int, int]:
+        '''
+        `_debounce(top, btm)` passes the raw rows through the debouncer and is the
+        debounced (top, bottom) rows. Both rows are debounced together as one word
+        with the top row in the upper half.
+
+        If any switch is still settling a follow-up poll is scheduled one debounce
+        period later, so the debounced state converges without waiting for another
+        interrupt.
+        '''
+        with self._debounce_lock:
+            now = time.monotonic()
+            raw = top_row << self.NUM_SWITCHES | btm_row
+
+            if self._debouncer is None:
+                # nothing to settle against yet, take the first reading as is
+                self._debouncer = BitDebouncer(self._debounce_settle_samples * 2, raw)
+                self._last_sample_t = now
+                return top_row, btm_row
+
+            was_pending = self._debouncer.pending
+            old_stable = self._debouncer.stable
+
+            # samples closer together than the period only reset integrators
+            advance = (now - self._last_sample_t) >= self._debounce_period_secs
+            if advance:
+                self._last_sample_t = now
+            stable = self._debouncer.update(raw, advance)
+            pending = self._debouncer.pending
+
+            self._debounce_stats['samples'] += 1
+            self._debounce_stats['glitches_rejected'] += bin(
+                was_pending & ~pending & ~(stable ^ old_stable)).count('1')
+
+            if was_pending == 0 and pending != 0:
+                self._settle_start_t = now
+            if stable != old_stable and self._settle_start_t is not None:
+                latency = now - self._settle_start_t
+                self._debounce_stats['last_latency_secs'] = latency
+                self._debounce_stats['max_latency_secs'] = max(
+                    latency, self._debounce_stats['max_latency_secs'])
+                self._settle_start_t = now if pending else None
+
+            if pending and self._debounce_due_t is None and not self._debounce_stop:
+                self._debounce_due_t = now + self._debounce_period_secs
+                if self._debounce_thread is None:
+                    self._debounce_thread = threading.Thread(
+                        target=self._run_debounce_follow_ups, name='UI_Switches debounce', daemon=True)
+                    self._debounce_thread.start()
+                self._debounce_cv.notify()
+
+            switch_mask = (1 << self.NUM_SWITCHES) - 1
+            return stable >> self.NUM_SWITCHES, stable & switch_mask
+
+    def _run_debounce_follow_ups(self) -> None:
+        '''
+        `_run_debounce_follow_ups()` is the debounce thread, it takes another sample
+        whenever a follow-up read falls due while switches are still settling.
+        '''
+        while True:
+            with self._debounce_cv:
+                while True:
+                    if self._debounce_stop:
+                        return
+                    if self._debounce_due_t is not None:
+                        remaining = self._debounce_due_t - time.monotonic()
+                        if remaining <= 0.0:
+                            break
+                        self._debounce_cv.wait(remaining)
+                    else:
+                        self._debounce_cv.wait()
+                self._debounce_due_t = None
+
+            self.poll(wait=False)
+
+    def _make_snapshot(
+        self,
+        top_row: int,
+        btm_row: int,
+        seq: int,
+        read_t_ns: int = 0,
+        edge_t_ns: Optional[int] = None
+    ) -> SwitchSnapshot:
+        '''
+        `_make_snapshot(top, btm, seq, t_read, t_edge)` is the decoded SwitchSnapshot of
+        the raw rows with sequence number `seq`, read at `t_read` after an edge at `t_edge`.
+        All of the voltage switches are decoded together with a few bitwise operations.
+        '''
+        all_switches = (1 << self.NUM_SWITCHES) - 1
+        if self.ACTIVE_LEVEL == 0:
+            closed_top = ~top_row & all_switches
+            closed_btm = ~btm_row & all_switches
+        else:
+            closed_top = top_row
+            closed_btm = btm_row
+
+        down_mask = closed_btm & self.V_SWITCH_MASK
+        up_mask = closed_top & ~closed_btm & self.V_SWITCH_MASK
+        middle_mask = ~(closed_top | closed_btm) & self.V_SWITCH_MASK
+
+        aux_mask = 0
+        for n, (on_top, bit) in enumerate(self._aux_wiring):
+            aux_mask |= (((closed_top if on_top else closed_btm) >> bit) & 1) << n
+
+        return self.SwitchSnapshot(
+            seq, top_row, btm_row, up_mask, middle_mask, down_mask, aux_mask, self.NUM_V_SWITCHES,
+            read_t_ns, edge_t_ns)
+
+    def _diff_snapshots(
+        self,
+        old: SwitchSnapshot,
+        new: SwitchSnapshot,
+        read_t_ns: int,
+        edge_t_ns: Optional[int]
+    ) -> Optional[SwitchEvent]:
+        '''
+        `_diff_snapshots(old, new, read_t, edge_t)` is the SwitchEvent describing the
+        change between the two snapshots, stamped with the read and edge times, or
+        None if no switch changed position.
+
+        Only the switches that moved are decoded, so the cost grows with the number
+        of switches that moved rather than with the number of switches.
+        '''
+        if old is new:
+            return None
+
+        # MIDDLE is implied by neither UP nor DOWN, so two masks are enough
+        v_switch_mask = (old.up_mask ^ new.up_mask) | (old.down_mask ^ new.down_mask)
+        aux_changed = old.aux_mask ^ new.aux_mask
+
+        if v_switch_mask == 0 and aux_changed == 0:
+            return None
+
+        v_switch_changes = []
+        remaining = v_switch_mask
+        while remaining:
+            lowest = remaining & -remaining
+            i = lowest.bit_length() - 1
+            remaining ^= lowest
+            v_switch_changes.append((i, old.position_at(i), new.position_at(i)))
+
+        aux_changes = []
+        while aux_changed:
+            lowest = aux_changed & -aux_changed
+            aux_changed ^= lowest
+            sw = self._aux_keys[lowest.bit_length() - 1]
+            aux_changes.append((sw, bool(new.aux_mask & lowest)))
+
+        return self.SwitchEvent(
+            v_switch_mask,
+            tuple(v_switch_changes),
+            tuple(aux_changes),
+            new,
+            read_t_ns,
+            edge_t_ns
+        )
+
     def _read_bank(self, addr: int) -> int:
         '''
         `_read_bank(addr)` the switches in a single PCA9555D bank at I2c address
@@ -170,45 +1868,120 @@ class UI_Switches:
         Raises:
             OSError if there is a problem reading the I2C bank.
         '''
+        chip = self._chips[addr]
         try:
-            INPUT_PORT_0 = 0
+            if chip.needs_verify:
+                chip.verify()
 
-            bits_0_to_7 = self._bus.read_byte_data(
-                addr,
-                INPUT_PORT_0
-            )
-            bits_8_to_15 = self._bus.read_byte(addr)
+            word = self._read_inputs(addr)
+            if self._inversion_lost(addr, word):
+                # the chip has been repaired, read it again with its inversion back
+                word = self._read_inputs(addr)
 
             self._addrs_with_errors.discard(addr)
 
-            return bits_8_to_15 << 8 | bits_0_to_7
+            return word
         except Exception:
+            # the failure may have been a brown-out, check the chip before trusting it again
+            chip.needs_verify = True
             self._addrs_with_errors.add(addr)
             raise OSError
 
-    def _read_row(self, row: Row) -> int:
+    def _read_inputs(self, addr: int) -> int:
+        '''
+        `_read_inputs(addr)` is the 16 bit word in the input ports of the chip at `addr`.
+        '''
+        if self._read_mode == self.ReadMode.BYTE:
+            self._num_transactions += 2
+            bits_0_to_7 = self._bus.read_byte_data(
+                addr,
+                self.INPUT_PORT_0
+            )
+            bits_8_to_15 = self._bus.read_byte(addr)
+        else:
+            # the PCA9555D auto-increments from port 0 to port 1, so both
+            # ports come back in one transaction
+            self._num_transactions += 1
+            bits_0_to_7, bits_8_to_15 = self._bus.read_i2c_block_data(
+                addr,
+                self.INPUT_PORT_0,
+                2
+            )
+        return bits_8_to_15 << 8 | bits_0_to_7
+
+    def _inversion_lost(self, addr: int, word: int) -> bool:
         '''
-        `_read_row(row)` is the value of all switches on the given row, read at once as
-        a 32 bit word where switch 0 is the LSB and switch 31 is the MSB. This includes
-        the voltage switches as well as the two aux switches.
+        `_inversion_lost(addr, w)` is true if the chip at `addr` had lost its polarity
+        inversion, as it does in a brown-out, so the word `w` just read from it is
+        wrong. The chip is repaired in that case.
 
-        Args:
-            `row`: the enumerated row to read
+        A brown-out flips every bit, so the polarity register is only read back when
+        `w` differs from the bank's last good word. Steady inputs cost nothing extra.
 
-        Examples:
-            - no switches are on -> 0x0000_0000
-            - switch 0 is on -> 0x0000_0001
-            - switches 2, 5, 19, and 30 are on -> 0x4008_0024
+        Raises:
+            OSError if there is a problem talking to the chip.
+        '''
+        if self.ACTIVE_LEVEL == 0 or word == self._bank_words[addr]:
+            return False
+        return not self._chips[addr].check(PCA9555.POLARITY_PORT_0)
+
+    def _read_banks_batched(self, addrs: list[int]) -> list[int]:
+        '''
+        `_read_banks_batched(addrs)` reads every PCA9555D bank in `addrs` with a
+        single queued i2c_rdwr call, and is the list of 16 bit words in the same
+        order as `addrs`.
+
+        Args:
+            `addrs`: the addresses of the chips to read.
 
         Raises:
-            OSError if there is a problem reading the I2C bank.
+            OSError if there is a problem with the transfer. Since the whole batch
+            fails together every address in the batch is marked as an error.
+        '''
+        try:
+            msgs = []
+            for addr in addrs:
+                msgs.append(i2c_msg.write(addr, [self.INPUT_PORT_0]))
+                msgs.append(i2c_msg.read(addr, 2))
+
+            self._num_transactions += 1
+            self._bus.i2c_rdwr(*msgs)
+
+            self._addrs_with_errors.difference_update(addrs)
+
+            words = []
+            for read_msg in msgs[1::2]:
+                bits_0_to_7, bits_8_to_15 = list(read_msg)
+                words.append(bits_8_to_15 << 8 | bits_0_to_7)
+            return words
+        except Exception:
+            self._addrs_with_errors.update(addrs)
+            raise OSError
+
+    def _read_bank_with_retry(self, addr: int) -> Optional[int]:
+        '''
+        `_read_bank_with_retry(addr)` is the 16 bit word read from the bank at `addr`,
+        retrying up to `bank_retries` times with a doubling backoff, or None if every
+        attempt failed. Successful reads update the bank's last known good word.
         '''
-        addrs = self._btm_row_addrs if row == self.Row.BOTTOM else self._top_row_addrs
+        backoff = self._bank_retry_backoff_secs
+        for attempt in range(self._bank_retries + 1):
+            if attempt > 0:
+                self._bank_stats[addr]['retries'] += 1
+                time.sleep(backoff)
+                backoff *= 2
+
+            try:
+                word = self._read_bank(addr)
+            except OSError:
+                self._bank_stats[addr]['errors'] += 1
+                continue
 
-        bits_0_15 = self._read_bank(addrs[0])
-        bits_16_31 = self._read_bank(addrs[1])
+            self._bank_words[addr] = word
+            self._bank_good_t[addr] = time.monotonic()
+            return word
 
-        return bits_16_31 << 16 | bits_0_15
+        return None
 
     def change_occured(self):
         '''
@@ -220,49 +1993,143 @@ class UI_Switches:
             return True
         return False
 
-    def v_switch_position_at(self, i: int) -> SwitchPos:
+    def get_events(self) -> list[SwitchEvent]:
         '''
-        `v_switch_position_at(i)` is the enumerated switch position of switch number `i`.
+        `get_events()` is the list of SwitchEvents queued since the last call, oldest
+        first. At most `MAX_PENDING_EVENTS` are kept, older ones are dropped.
+        '''
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
+
+    async def events(self) -> AsyncIterator[SwitchEvent]:
         '''
-        def bit_at(num: int, pos: int) -> int:
-            return (num >> pos) & 1
+        `events()` is an async iterator over the SwitchEvents from every poll made
+        after iteration starts, for use as `async for event in switches.events()`.
 
-        nc_row = self._cached_top_row
-        no_row = self._cached_btm_row
+        Events are handed from the interrupt thread to the running event loop with
+        `call_soon_threadsafe`, so an idle consumer costs no CPU. If the consumer
+        falls more than `MAX_PENDING_EVENTS` behind the oldest events are dropped.
+        '''
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.MAX_PENDING_EVENTS)
+        subscriber = (loop, queue)
 
-        if bit_at(nc_row, i) == self.ACTIVE_LEVEL and bit_at(no_row, i) != self.ACTIVE_LEVEL:
-            return self.SwitchPos.UP
-        elif bit_at(nc_row, i) != self.ACTIVE_LEVEL and bit_at(no_row, i) != self.ACTIVE_LEVEL:
-            return self.SwitchPos.MIDDLE
-        else:
-            return self.SwitchPos.DOWN
+        with self._async_lock:
+            self._async_queues.append(subscriber)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._async_lock:
+                self._async_queues.remove(subscriber)
+
+    async def wait_for_change(self, timeout: Optional[float] = None) -> Optional[SwitchEvent]:
+        '''
+        `wait_for_change(t)` waits up to `t` seconds for the next SwitchEvent and is
+        that event, or None if the timeout expires first. A timeout of None waits
+        forever.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+
+        with self._async_lock:
+            self._async_waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._async_lock:
+                if waiter in self._async_waiters:
+                    self._async_waiters.remove(waiter)
+
+    def _publish_async(self, event: SwitchEvent) -> None:
+        '''
+        `_publish_async(e)` hands the event `e` to every asyncio consumer. This runs
+        on the polling or dispatcher thread, so all of the work is scheduled onto
+        each consumer's own event loop.
+        '''
+        def put_dropping_oldest(queue: asyncio.Queue, event: UI_Switches.SwitchEvent) -> None:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+        def resolve(future: asyncio.Future, event: UI_Switches.SwitchEvent) -> None:
+            if not future.done():
+                future.set_result(event)
+
+        with self._async_lock:
+            queues = list(self._async_queues)
+            waiters = self._async_waiters
+            self._async_waiters = []
+
+        for loop, queue in queues:
+            try:
+                loop.call_soon_threadsafe(put_dropping_oldest, queue, event)
+            except RuntimeError:
+                # the consumer's loop has been closed
+                pass
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(resolve, future, event)
+            except RuntimeError:
+                pass
+
+    def get_snapshot(self) -> SwitchSnapshot:
+        '''
+        `get_snapshot()` is the immutable SwitchSnapshot made by the latest poll.
+
+        Prefer taking one snapshot and querying it over calling several of the
+        accessors below, since a poll can land between two accessor calls.
+        '''
+        return self._snapshot
+
+    def changed_since(self, seq: int) -> bool:
+        '''
+        `changed_since(seq)` is true iff the switches have changed since the snapshot
+        with sequence number `seq` was published. This reads the cached snapshot
+        only, no I2C traffic is generated.
+        '''
+        return self._snapshot.seq != seq
+
+    def v_switch_position_at(self, i: int) -> SwitchPos:
+        '''
+        `v_switch_position_at(i)` is the enumerated switch position of switch number `i`.
+        '''
+        return self._snapshot.position_at(i)
 
     def list_of_v_switch_positions(self) -> list[SwitchPos]:
         '''
-        `list_of_v_switch_positions()` is all 30 voltage switches represented
+        `list_of_v_switch_positions()` is all voltage switches represented
         as a list of enumerated switch positions. Voltage switch 0 is at
-        index zero, and voltage switch 29 is at index 29.
+        index zero, and on the standard panel voltage switch 29 is at index 29.
         '''
-        return [self.v_switch_position_at(i) for i in range(self.NUM_V_SWITCHES)]
+        return list(self._snapshot.positions)
 
     def get_voltage_switch_row(self, row: Row) -> int:
         '''
         `get_voltage_switch_row(row)` is the given enumerated row of switches represented
         as an integer where switch 0 is the LSB and switch 29 is the MSB.
 
-        The returned value only contains the 30 voltage switches, not the two aux
-        switches.
+        The returned value only contains the voltage switches, not the aux switches.
+        A closed switch's bit is at ACTIVE_LEVEL, which is 1 when the chips invert
+        their inputs in hardware and 0 otherwise.
         '''
-        row_as_ui32 = self._cached_btm_row if row == self.Row.BOTTOM else self._cached_top_row
+        snapshot = self._snapshot
+        row_as_int = snapshot.btm_row if row == self.Row.BOTTOM else snapshot.top_row
 
-        # ignore the two aux switches
-        return row_as_ui32 & self.V_SWITCH_MASK
+        # ignore the aux switches
+        return row_as_int & self.V_SWITCH_MASK
 
     def get_shock_level(self) -> int:
         '''
         `get_shock_level()` is the position of the highest DOWN voltage switch.
         A result of 0 means that none of the switches are DOWN. A result of an
-        integer `n` in the range [1..30] means that `n` is the highest of
+        integer `n` in the range [1..NUM_V_SWITCHES] means that `n` is the highest of
         the switches that are currently in the DOWN position. The returned value
         is one-higher than the bit position of the highest switch, to account
         for the zero setting where no switches are DOWN.
@@ -272,31 +2139,18 @@ class UI_Switches:
             - switch 0 is DOWN and all others are with UP or in the MIDDLE -> 1
             - switches 3, 7, and 14 are DOWN -> 15
         '''
-        n = self.get_voltage_switch_row(self.Row.BOTTOM)
-
-        # look from high to low for a switch that is engaged
-        for i in reversed(range(self.NUM_V_SWITCHES)):
-            if ((n >> i) & 1) == self.ACTIVE_LEVEL:
-                return i + 1
-
-        # if we get here none of the switches are DOWN
-        return 0
+        return self._snapshot.shock_level
 
     def get_aux_switch(self, switch: AuxSwitch) -> bool:
         '''
         `get_aux_switch(sw)` is true iff the enumerated aux switch `sw` is
-        physically closed.
-        '''
-        if switch == self.AuxSwitch.ONE:
-            return ((self._cached_top_row >> 30) & 1) == self.ACTIVE_LEVEL
-        elif switch == self.AuxSwitch.TWO:
-            return ((self._cached_btm_row >> 30) & 1) == self.ACTIVE_LEVEL
-        elif switch == self.AuxSwitch.THREE:
-            return ((self._cached_top_row >> 31) & 1) == self.ACTIVE_LEVEL
-        elif switch == self.AuxSwitch.FOUR:
-            return ((self._cached_btm_row >> 31) & 1) == self.ACTIVE_LEVEL
-        else:
+        physically closed, switches that are not in the aux switch map are never
+        closed.
+        '''
+        n = self._aux_index.get(switch)
+        if n is None:
             return False
+        return bool((self._snapshot.aux_mask >> n) & 1)
 
     def get_status(self) -> StatusCode:
         '''
@@ -304,6 +2158,111 @@ class UI_Switches:
         '''
         return self.STATUS
 
+    def get_pending_mask(self) -> int:
+        '''
+        `get_pending_mask()` is the voltage switches that are still settling: bit i
+        is set iff either contact of voltage switch i has a new state that the
+        debouncer has not reported yet. Always 0 without debouncing.
+        '''
+        debouncer = self._debouncer
+        if debouncer is None:
+            return 0
+        pending = debouncer.pending
+        return ((pending >> self.NUM_SWITCHES) | pending) & self.V_SWITCH_MASK
+
+    def get_debounce_stats(self) -> dict:
+        '''
+        `get_debounce_stats()` is a copy of the debounce counters:
+
+            samples           : readings passed through the debouncer
+            glitches_rejected : switch inputs that started to change and then went
+                                back before they settled
+            last_latency_secs : time from a switch first changing to it being
+                                reported, for the most recent change
+            max_latency_secs  : the worst latency seen so far
+        '''
+        return dict(self._debounce_stats)
+
+    def get_bank_stats(self) -> dict[int, dict]:
+        '''
+        `get_bank_stats()` is the health of every PCA9555D bank, keyed by I2C address:
+
+            errors   : failed read attempts, including ones that a retry recovered
+            retries  : retry attempts made
+            age_secs : time since the bank was last read successfully, the bank's
+                       bits in the published rows are this stale. None if the bank
+                       has never been read.
+            chip     : the PCA9555 driver counters, `repairs` counts brown-outs
+        '''
+        now = time.monotonic()
+        stats = {}
+        for addr, counters in self._bank_stats.items():
+            good_t = self._bank_good_t[addr]
+            stats[addr] = dict(
+                counters,
+                age_secs=None if good_t is None else now - good_t,
+                chip=dict(self._chips[addr].stats)
+            )
+        return stats
+
+    def get_watchdog_stats(self) -> dict:
+        '''
+        `get_watchdog_stats()` is a copy of the stuck-interrupt watchdog counters:
+
+            stuck_episodes     : times the line was found low without a fresh read
+            watchdog_polls     : reads made by the watchdog rather than the interrupt
+            last_recovery_secs : time from detecting the most recent stuck line to
+                                 seeing it released
+            max_recovery_secs  : the worst recovery time seen so far
+        '''
+        return dict(self._watchdog_stats)
+
+    def get_dispatch_stats(self) -> Optional[dict]:
+        '''
+        `get_dispatch_stats()` is a copy of the callback dispatcher counters, see
+        `CoalescingDispatcher.get_stats()`, or None if callbacks are not threaded.
+        `events_dropped` counts the events lost because the dispatcher fell more
+        than `MAX_PENDING_EVENTS` behind.
+        '''
+        if self._dispatcher is None:
+            return None
+        stats = self._dispatcher.get_stats()
+        with self._dispatch_events_lock:
+            stats['events_dropped'] = self._num_dispatch_events_dropped
+        return stats
+
+    def close(self) -> None:
+        '''
+        `close()` stops the watchdog, any pending debounce read and the callback
+        dispatcher, and releases the interrupt pin.
+        '''
+        if self._watchdog_thread is not None:
+            self._watchdog_stop.set()
+            self._watchdog_wake.set()
+            if self._watchdog_thread is not threading.current_thread():
+                self._watchdog_thread.join()
+            self._watchdog_thread = None
+
+        with self._debounce_cv:
+            self._debounce_stop = True
+            self._debounce_due_t = None
+            self._debounce_cv.notify()
+        if self._debounce_thread is not None and self._debounce_thread is not threading.current_thread():
+            self._debounce_thread.join()
+        self._interrupt_pin.close()
+
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+
+    def get_num_i2c_transactions(self) -> int:
+        '''
+        `get_num_i2c_transactions()` is the number of I2C transactions issued
+        since initialization. A full poll costs 8 transactions with ReadMode.BYTE,
+        4 with ReadMode.BLOCK, and 1 with ReadMode.BATCH, plus the occasional
+        register check and repair made by the PCA9555 drivers.
+        '''
+        return self._num_transactions + sum(chip.num_transactions for chip in self._chips.values())
+
 
 def do_demo():
     '''
@@ -341,12 +2300,20 @@ def do_demo():
         ADDR_16_31_TOP, ADDR_0_15_BTM,
         ADDR_16_31_BTM,
         INTERRUPT_PIN,
-        Demo_Callback()
+        Demo_Callback(),
+        threaded_callbacks=True
     )
 
     def print_switch_summary():
         print('\n' + '*'*100 + '\n')
 
+        # you can see exactly what moved since the last summary like this
+        for event in ui_switches.get_events():
+            for i, old_pos, new_pos in event.v_switch_changes:
+                print(f"Switch {i} moved {old_pos} -> {new_pos}")
+            for sw, engaged in event.aux_changes:
+                print(f"{sw} {'engaged' if engaged else 'released'}")
+
         # you can read a whole row as an integer like this
         val_ui30_closed = ui_switches.get_voltage_switch_row(
             UI_Switches.Row.TOP)
@@ -376,34 +2343,74 @@ def do_demo():
 
         # check the I2C health like this
         print(f"I2C communication status: {ui_switches.get_status()}")
+        print(f"I2C transactions so far: {ui_switches.get_num_i2c_transactions()}")
 
         if len(ui_switches._addrs_with_errors) != 0:
             print(
                 f"Error at address(es): {[hex(x) for x in ui_switches._addrs_with_errors] }")
+            for addr, stats in ui_switches.get_bank_stats().items():
+                print(f"  bank {addr:#04x}: {stats}")
 
-    # heartbeat to un-stick potential stuck interrupt line
-    heartbeat_t = time.time()
-    heartbeat_period = 5
-
+    # there is no need for a heartbeat poll, the built in watchdog un-sticks the
+    # interrupt line if mechanical chatter leaves it held low
     while True:
 
         if ui_switches.change_occured():
             print_switch_summary()
+            print(f"Watchdog: {ui_switches.get_watchdog_stats()}")
 
         # brief sleep so that the terminal doesn't get bogged down on switch chattering
         time.sleep(.25)
 
-        if (heartbeat_t + heartbeat_period) < time.time():
-            print("\nheart beat")
-            heartbeat_t += heartbeat_period
-
-            # Because of the way the PCA9555 works, it is possible for it to get stuck with an un-cleared interrupt.
-            # Interrupts are cleared when the pin state changes OR a read is performed. If the switches do a lot of
-            # mechanical chattering it can miss a pin state change and get stuck low, which will stop the system from
-            # working.
-            # Manually reading the switches un-sticks any frozen interrupts if it is a problem. Maybe it makes sense to
-            # just periodically poll the switches instead or relying on the interrrupt line, I'm not decided yet.
-            ui_switches.poll()
+
+def do_async_demo():
+    '''
+    Do a demo to show that switch changes can be consumed from asyncio without
+    polling.
+    '''
+    I2C_CHANNEL = 1
+    bus = smbus.SMBus(I2C_CHANNEL)
+
+    # change these addresses to suit your physical board setup
+    ADDR_0_15_TOP = 0x20
+    ADDR_0_15_BTM = 0x21
+    ADDR_16_31_TOP = 0x22
+    ADDR_16_31_BTM = 0x23
+
+    INTERRUPT_PIN = 19
+
+    ui_switches = UI_Switches(
+        bus,
+        ADDR_0_15_TOP,
+        ADDR_16_31_TOP,
+        ADDR_0_15_BTM,
+        ADDR_16_31_BTM,
+        INTERRUPT_PIN
+    )
+
+    async def watch_switches():
+        # the loop sleeps until the interrupt thread hands over an event
+        async for event in ui_switches.events():
+            for i, old_pos, new_pos in event.v_switch_changes:
+                print(f"Switch {i} moved {old_pos} -> {new_pos}")
+            for sw, engaged in event.aux_changes:
+                print(f"{sw} {'engaged' if engaged else 'released'}")
+            if event.edge_t_ns is not None:
+                print(f"Edge to read latency: {(event.read_t_ns - event.edge_t_ns) / 1e6:.3f} ms")
+            print(f"Shock level is: {ui_switches.get_shock_level()}\n")
+
+    async def report_idle():
+        while True:
+            if await ui_switches.wait_for_change(timeout=10.0) is None:
+                print("no switch activity in the last 10 seconds")
+
+    async def main():
+        await asyncio.gather(watch_switches(), report_idle())
+
+    try:
+        asyncio.run(main())
+    finally:
+        ui_switches.close()
 
 
 if __name__ == "__main__":